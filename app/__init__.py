@@ -1,9 +1,13 @@
 from flask import Flask, render_template
+from werkzeug.contrib.fixers import ProxyFix
 from flask_migrate import Migrate
 from flask_login import current_user
 
 from app.libs.enums import RoleEnum
-from app.models import db, login_manager
+from app.libs.upload import StreamingRequest
+from app.models import db, login_manager, movie_counter, movie_search, reference_cache, index_cache, audit_writer, \
+    thumbnailer, media_store, pool_monitor, request_metrics, \
+    identity_cache, permission_matrix, password_hasher, rate_limiter
 
 
 migrate = Migrate()
@@ -23,16 +27,33 @@ def page_not_forbidden(error):
 
 def create_app():
     app = Flask(__name__)
+    app.request_class = StreamingRequest
     app.config.from_object('app.security')
     app.config.from_object('app.settings')
+    if app.config['PROXY_COUNT']:
+        # 反向代理之后，request.remote_addr取X-Forwarded-For中由最近的PROXY_COUNT个代理之前的客户端地址
+        app.wsgi_app = ProxyFix(app.wsgi_app, num_proxies=app.config['PROXY_COUNT'])
 
     db.init_app(app)
+    request_metrics.init_app(app)
+    pool_monitor.init_app(app)
+    audit_writer.init_app(app)
     migrate.init_app(app=app, db=db)
     login_manager.init_app(app=app)
+    identity_cache.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    movie_counter.init_app(app)
+    movie_search.init_app(app)
+    reference_cache.init_app(app)
+    index_cache.init_app(app)
+    thumbnailer.init_app(app)
+    media_store.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = '请登录或者注册帐号'
 
     register_bp(app=app)
+    permission_matrix.init_app(app)
 
     with app.app_context():
         db.create_all(app=app)
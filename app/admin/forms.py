@@ -4,7 +4,7 @@ from wtforms import StringField, SubmitField, TextAreaField, FileField, SelectFi
 from wtforms.validators import DataRequired
 
 
-from app.models import Tag
+from app.models import reference_cache
 
 
 class TagForm(FlaskForm):
@@ -133,7 +133,7 @@ class MovieForm(FlaskForm):
 
     def __init__(self):
         super().__init__()
-        self.tag_id.choices = [(int(tag.id), tag.name) for tag in Tag.query.all()]
+        self.tag_id.choices = [(int(tag.id), tag.name) for tag in reference_cache.get('tags')]
 
 
 class PreviewForm(FlaskForm):
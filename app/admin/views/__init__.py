@@ -3,6 +3,7 @@ import app.admin.views.movie
 import app.admin.views.tag
 import app.admin.views.preview
 import app.admin.views.log
+import app.admin.views.upload
 
 
 
@@ -3,10 +3,18 @@ from flask_login import login_required
 
 from .. import admin
 from ...libs.permissions import admin_required
+from ...models import index_cache, pool_monitor, request_metrics
 
 
 @admin.route('/')
 @login_required
 @admin_required
 def index():
-    return render_template('admin/index.html')
+    return render_template('admin/index.html', index_cache=index_cache.stats(), pool=pool_monitor.status())
+
+
+@admin.route('/metrics/')
+@login_required
+@admin_required
+def metrics():
+    return render_template('admin/metrics.html', metrics=request_metrics.stats())
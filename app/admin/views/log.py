@@ -1,8 +1,8 @@
-from flask import render_template, current_app
+from flask import render_template
 from flask_login import login_required, current_user
 
 from .. import admin
-from ...models import UserLog, AdminLog, OpLog, User
+from ...models import UserLog, AdminLog, OpLog, User, list_query
 from ...libs.permissions import log_admin_required, admin_required
 from ...libs.enums import AuthEnum
 
@@ -13,32 +13,40 @@ from ...libs.enums import AuthEnum
 def oplog_list(page=None):
     if page is None:
         page = 1
-    page_data = OpLog.query.filter_by().order_by(
-        OpLog.create_time.desc()
-    ).paginate(page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = OpLog.query.filter_by().load_profile().seek(page=page)
     return render_template('admin/oplog_list.html', page_data=page_data)
 
 
+@list_query('admin.admin_login_log_list')
+def admin_log_query():
+    return AdminLog.query.join(User).filter(
+        User.auth >= AuthEnum.Admin, User.status==True
+    ).order_by(AdminLog.create_time.desc(), AdminLog.id.desc())
+
+
 @admin.route('/admin_login_log/list/<int:page>/')
 @login_required
 @log_admin_required
 def admin_login_log_list(page=None):
     if page is None:
         page = 1
-    page_data = AdminLog.query.join(User).filter(User.auth >= AuthEnum.Admin, User.status==True).order_by(
-        AdminLog.create_time.desc()
-    ).paginate(page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = admin_log_query().load_profile().seek(page=page)
     return render_template('admin/admin_login_log_list.html', page_data=page_data)
 
 
+@list_query('admin.user_login_log_list')
+def user_log_query():
+    return UserLog.query.join(User).filter(
+        User.auth == AuthEnum.User, User.status==True
+    ).order_by(UserLog.create_time.desc(), UserLog.id.desc())
+
+
 @admin.route('/user_login_log/list/<int:page>/')
 @login_required
 @admin_required
 def user_login_log_list(page=None):
     if page is None:
         page = 1
-    page_data = UserLog.query.join(User).filter(User.auth == AuthEnum.User, User.status==True).order_by(
-        UserLog.create_time.desc()
-    ).paginate(page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = user_log_query().load_profile().seek(page=page)
     return render_template('admin/user_login_log_list.html', page_data=page_data)
 
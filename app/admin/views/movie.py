@@ -3,7 +3,7 @@ from flask_login import login_required
 
 from .. import admin
 from ..forms import MovieForm
-from ...models import Movie, db, Tag
+from ...models import Movie, db, reference_cache, list_query
 from ...libs.permissions import movie_admin_required
 
 
@@ -11,7 +11,7 @@ from ...libs.permissions import movie_admin_required
 @login_required
 @movie_admin_required
 def movie_add():
-    tags = Tag.query.all()
+    tags = reference_cache.get('tags')
     form = MovieForm()
     if form.validate_on_submit():
         movie = Movie()
@@ -53,14 +53,17 @@ def movie_edit(movie_id):
     return render_template('admin/movie_edit.html', form=form, movie=movie)
 
 
+@list_query('admin.movie_list')
+def movie_list_query():
+    # filter_by()自定义的查询方式
+    return Movie.query.filter_by().order_by(Movie.create_time.desc())
+
+
 @admin.route('/movie/list/<int:page>/')
 @login_required
 @movie_admin_required
 def movie_list(page=None):
     if page is None:
         page = 1
-    # filter_by()自定义的查询方式
-    page_data = Movie.query.filter_by().order_by(
-        Movie.create_time.desc()
-    ).paginate(page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = movie_list_query().load_profile().paginate(page=page, per_page=current_app.config['PER_PAGE'])
     return render_template('admin/movie_list.html', page_data=page_data)
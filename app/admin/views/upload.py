@@ -0,0 +1,54 @@
+import json
+
+from flask import request, current_app, abort
+from flask_login import login_required
+
+from .. import admin
+from ...libs.upload import ChunkedUpload
+from ...libs.permissions import movie_admin_required
+
+
+def _load_upload(upload_id):
+    upload = ChunkedUpload.load(current_app.config['UPLOAD_STAGING_PATH'], upload_id)
+    if upload is None:
+        abort(404)
+    return upload
+
+
+def _upload_status(upload):
+    return {'upload_id': upload.upload_id, 'offset': upload.offset, 'size': upload.size}
+
+
+@admin.route('/upload/', methods=['POST'])
+@login_required
+@movie_admin_required
+def upload_create():
+    filename = request.form.get('filename', '')
+    size = request.form.get('size', 0, type=int)
+    if (not filename) or (size <= 0):
+        abort(400)
+    # 顺便清理长时间没有续传的会话
+    ChunkedUpload.expire(current_app.config['UPLOAD_STAGING_PATH'], current_app.config['UPLOAD_STAGING_EXPIRE'])
+    upload = ChunkedUpload.create(current_app.config['UPLOAD_STAGING_PATH'], filename, size)
+    return json.dumps(_upload_status(upload))
+
+
+@admin.route('/upload/<upload_id>/', methods=['GET'])
+@login_required
+@movie_admin_required
+def upload_status(upload_id):
+    return json.dumps(_upload_status(_load_upload(upload_id)))
+
+
+@admin.route('/upload/<upload_id>/', methods=['PUT'])
+@login_required
+@movie_admin_required
+def upload_chunk(upload_id):
+    # 请求体即分片内容，按offset追加；offset与已上传大小不一致或同一会话正在写入时返回409和当前offset以便续传
+    upload = _load_upload(upload_id)
+    offset = request.args.get('offset', 0, type=int)
+    try:
+        upload.write(offset, request.stream, current_app.config['UPLOAD_CHUNK_SIZE'])
+    except ValueError:
+        return json.dumps(_upload_status(upload)), 409
+    return json.dumps(_upload_status(upload))
@@ -1,8 +1,7 @@
 from flask_wtf import FlaskForm
-from wtforms import SubmitField, ValidationError, PasswordField, StringField, SelectField, FileField, TextAreaField
+from wtforms import SubmitField, PasswordField, StringField, SelectField, FileField, TextAreaField
 from wtforms.validators import DataRequired, Length, EqualTo, Email
 
-from ..models import User
 from ..libs.enums import RoleEnum
 
 
@@ -111,18 +110,6 @@ class RegisterForm(EmailForm):
         }
     )
 
-    def validate_email(self, field):
-        if User.query.filter_by(email=field.data).first():
-            raise ValidationError('邮箱已被注册')
-
-    def validate_name(self, field):
-        if User.query.filter_by(name=field.data).first():
-            raise ValidationError('昵称被占用')
-
-    def validate_phone(self, field):
-        if User.query.filter_by(phone=field.data).first():
-            raise ValidationError('手机已经被使用')
-
 
 class ChangePasswordForm(FlaskForm):
     old_password = PasswordField(
@@ -3,18 +3,17 @@ from flask_login import current_user, logout_user, login_user, login_required
 
 from . import auth
 from .forms import LoginForm, RegisterForm, ChangePasswordForm, AdminForm
-from app.models import AdminLog, User, UserLog
+from app.models import AdminLog, User, UserLog, identity_cache, rate_limiter, list_query
 from ..libs.enums import AuthEnum, RoleEnum
 from ..libs.permissions import admin_required, user_admin_required, super_admin_required
 
 
 def _login(user):
     login_user(user, remember=True)
+    identity_cache.save(user)
     if (user.auth == AuthEnum.Admin) or (user.auth == AuthEnum.SuperAdmin):
-        admin_log = AdminLog()
-        admin_log.add()
-    user_log = UserLog()
-    user_log.add()
+        AdminLog.record()
+    UserLog.record()
     next_ = request.args.get('next')
     # not next_.startswith('/') 防止重定向攻击
     if (next_ is None) or (not next_.startswith('/')):
@@ -25,6 +24,11 @@ def _login(user):
     return next_
 
 
+@list_query('auth.login', email='user@example.com')
+def login_query(email):
+    return User.query.filter_by(email=email)
+
+
 @auth.route('/login/', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -33,8 +37,16 @@ def login():
     if form.validate_on_submit():
         email = form.email.data
         password = form.password.data
-        user = User.query.filter_by(email=email).first()
-        if (user is None) or not user.check_password(password):
+        # 在查询用户和校验密码之前限流
+        wait = rate_limiter.check('login', ip=request.remote_addr, email=email.lower())
+        if wait:
+            flash(f'尝试次数过多，请{wait}秒后再试', category='error')
+            return render_template('auth/login.html', form=form), 429
+        user = login_query(email).first()
+        ok = (user is not None) and user.check_password(password)
+        if ok is None:
+            flash('登录请求过多，请稍后再试', category='error')
+        elif not ok:
             flash('账号密码不匹配', category='error')
         else:
             next_ = _login(user)
@@ -49,6 +61,10 @@ def register():
         logout_user()
     form = RegisterForm()
     if form.validate_on_submit():
+        wait = rate_limiter.check('register', ip=request.remote_addr)
+        if wait:
+            flash(f'注册过于频繁，请{wait}秒后再试', category='error')
+            return render_template('auth/register.html', form=form), 429
         user = User()
         if not user.add(form, record_log=False):
             return redirect(url_for('auth.register'))
@@ -76,15 +92,18 @@ def change_password():
     return render_template('auth/change_password.html', form=form)
 
 
+@list_query('auth.user_list')
+def user_list_query():
+    return User.query.filter_by(auth=AuthEnum.User).order_by(User.create_time.desc())
+
+
 @auth.route('/admin/user/list/<int:page>')
 @login_required
 @admin_required
 def user_list(page=None):
     if page is None:
         page = 1
-    page_data = User.query.filter_by(auth=AuthEnum.User).order_by(
-        User.create_time.desc()
-    ).paginate(page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = user_list_query().paginate(page=page, per_page=current_app.config['PER_PAGE'])
     return render_template('admin/user_list.html', page_data=page_data)
 
 
@@ -2,41 +2,70 @@ from flask import render_template, request, url_for, current_app, flash, redirec
 from flask_login import current_user, login_required
 
 from app.auth.forms import UserInfoForm
-from ...models import Tag, Movie, Preview, User, UserLog
+from ...models import Movie, User, UserLog, reference_cache, index_cache, list_query
 from .. import home
 
 
+def index_cache_key(page=None):
+    args = request.args
+    filters = tuple(args.get(name, 0, type=int) for name in ('tid', 'star', 'time', 'play_num', 'comment_num'))
+    return (page or 1,) + filters + (args.get('after'), args.get('before'))
+
+
+@list_query('home.index')
+@list_query('home.index?tid&star', tid=1, star=5)
+def movie_index_query(tid=0, star=0):
+    # 默认按时间倒序，与seek的排序一致
+    query = Movie.query
+    if tid != 0:
+        query = query.filter_by(tag_id=tid)
+    if star != 0:
+        query = query.filter_by(star=star)
+    return query.order_by(Movie.create_time.desc(), Movie.id.desc())
+
+
 @home.route('/')
 @home.route("/<int:page>/")
+@index_cache.cached(index_cache_key)
 def index(page=None):
     if page is None:
         page = 1
-    tags = Tag.query.all()
-    page_data = Movie.query
-
+    tags = reference_cache.get('tags')
     tid = request.args.get("tid", 0)
-    if int(tid) != 0:
-        page_data = page_data.filter_by(tag_id=int(tid))
-
     star = request.args.get("star", 0)
-    if int(star) != 0:
-        page_data = page_data.filter_by(star=int(star))
+    page_data = movie_index_query(int(tid), int(star))
 
     time = request.args.get("time", 0)
+    play_num = request.args.get("play_num", 0)
+    comment_num = request.args.get("comment_num", 0)
+    params = {
+        'tid': tid,
+        'star': star,
+        'time': time,
+        'play_num': play_num,
+        'comment_num': comment_num,
+    }
+
+    if (int(play_num) == 0) and (int(comment_num) == 0):
+        # 只按时间排序时使用keyset分页
+        page_data = page_data.seek(page=int(page), desc=(int(time) != 2))
+        page_data.args = params
+        return render_template("home/index.html", tags=tags, params=params, page_data=page_data)
+
+    # 按播放量/评论量排序时去掉默认的时间排序
+    page_data = page_data.order_by(None)
     if int(time) != 0:
         if int(time) == 1:
             page_data = page_data.order_by(Movie.create_time.desc())
         else:
             page_data = page_data.order_by(Movie.create_time.asc())
 
-    play_num = request.args.get("play_num", 0)
     if int(play_num) != 0:
         if int(play_num) == 1:
             page_data = page_data.order_by(Movie.play_num.desc())
         else:
             page_data = page_data.order_by(Movie.play_num.asc())
 
-    comment_num = request.args.get("comment_num", 0)
     if int(comment_num) != 0:
         if int(comment_num) == 1:
             page_data = page_data.order_by(Movie.comment_num.desc())
@@ -44,19 +73,12 @@ def index(page=None):
             page_data = page_data.order_by(Movie.comment_num.asc())
 
     page_data = page_data.paginate(page=int(page), per_page=current_app.config['PER_PAGE'])
-    params = {
-        'tid': tid,
-        'star': star,
-        'time': time,
-        'play_num': play_num,
-        'comment_num': comment_num,
-    }
     return render_template("home/index.html", tags=tags, params=params, page_data=page_data)
 
 
 @home.route('/animation/')
 def animation():
-    data = Preview.query.all()
+    data = reference_cache.get('previews')
     return render_template('home/animation.html', data=data)
 
 
@@ -1,36 +1,40 @@
 import json
+import os
+import mimetypes
+from urllib.parse import quote
 
-from flask import current_app, render_template, request, flash, redirect, url_for
-from flask_login import current_user
+from flask import current_app, render_template, request, flash, redirect, url_for, send_from_directory, safe_join, abort
+from flask_login import current_user, login_required
 from sqlalchemy import and_
 
 from app.home import home
 from app.home.forms.main import CommentForm
-from app.models import MovieCol, Movie, Comment, db
+from app.models import MovieCol, Movie, Comment, movie_counter, movie_search, thumbnailer, rate_limiter, \
+    list_query
 
 
 @home.route('/movie_col/list/<int:page>')
 def movie_col_list(page=None):
     if page is None:
         page = 1
-    page_data = MovieCol.query.filter_by(user_id=current_user.id).paginate(
+    page_data = MovieCol.query.filter_by(user_id=current_user.id).load_profile().paginate(
         page=page, per_page=current_app.config['PER_PAGE'])
     return render_template('home/movie_col_list.html', page_data=page_data)
 
 
 @home.route('/movie_col/add')
+@login_required
 def movie_col_add():
-    uid = request.args.get('uid', '')
     mid = request.args.get('mid', '')
-    movie_col = MovieCol.query.filter_by(user_id=int(uid), movie_id=int(mid)).first()
-    if movie_col:
-        result = {'ok': 0}
-    else:
-        movie_col = MovieCol()
-        movie_col.user_id = uid
-        movie_col.movie_id = mid
-        movie_col.add()
-        result = {'ok': 1}
+    # 只能收藏到当前登录用户名下，限流同样按登录用户计数
+    wait = rate_limiter.check('movie_col_add', user=current_user.id, ip=request.remote_addr)
+    if wait:
+        return json.dumps({'ok': 0, 'wait': wait}), 429
+    movie_col = MovieCol()
+    movie_col.user_id = current_user.id
+    movie_col.movie_id = int(mid)
+    # 已收藏时违反唯一约束，add返回False
+    result = {'ok': 1 if movie_col.add() else 0}
 
     return json.dumps(result)
 
@@ -41,12 +45,14 @@ def search(page=None):
         page = 1
 
     key = request.args.get('key', '')
-    page_data = Movie.query.filter(Movie.title.ilike(f'%{key}%', Movie.status == True))
-    count = page_data.count()
-    page_data = page_data.paginate(
-        page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = movie_search.search(key, page=page, per_page=current_app.config['PER_PAGE'])
     page_data.key = key
-    return render_template('home/search.html', key=key, count=count, page_data=page_data)
+    return render_template('home/search.html', key=key, count=page_data.total, page_data=page_data)
+
+
+@list_query('home.play', movie_id=1)
+def movie_comment_query(movie_id):
+    return Comment.query.filter_by(movie_id=movie_id)
 
 
 @home.route('/play/<int:movie_id>/<int:page>/', methods=['GET', 'POST'])
@@ -54,29 +60,60 @@ def play(movie_id=None, page=None):
     if page is None:
         page = 1
     movie = Movie.query.get_or_404(movie_id)
-    page_data = Comment.query.filter_by(movie_id=movie_id).paginate(
-        page=page, per_page=current_app.config['PER_PAGE'])
     form = CommentForm()
     if form.validate_on_submit():
         comment = Comment()
         comment.movie_id = movie_id
         comment.user_id = current_user.id
-        with db.auto_commit():
-            movie.comment_num += 1
         comment.add(form)
         return redirect(url_for('home.play', movie_id=movie.id, page=1))
 
-    with db.auto_commit():
-        movie.play_num += 1
+    movie_counter.incr(movie.id, 'play_num')
 
+    page_data = movie_comment_query(movie_id).load_profile().paginate(
+        page=page, per_page=current_app.config['PER_PAGE'])
     return render_template('home/play.html', movie=movie, form=form, page_data=page_data)
 
 
+@list_query('home.comment_list', user_id=1)
+def user_comment_query(user_id):
+    return Comment.query.filter_by(user_id=user_id).order_by(Comment.create_time.desc(), Comment.id.desc())
+
+
 @home.route('/comment/list/<int:page>')
 def comment_list(page=None):
     if page is None:
         page = 1
-    page_data = Comment.query.filter_by(user_id=current_user.id).paginate(
-        page=page, per_page=current_app.config['PER_PAGE'])
+    page_data = user_comment_query(current_user.id).load_profile().seek(page=page)
     return render_template('home/comment_list.html', page_data=page_data)
 
+
+@home.route('/video/<path:filename>')
+def video(filename):
+    offload = current_app.config['VIDEO_OFFLOAD']
+    if not offload:
+        # send_from_directory处理Range/If-Range/ETag，完整文件通过wsgi.file_wrapper交给服务器(sendfile)
+        response = send_from_directory(current_app.config['MOVIE_PATH'], filename, conditional=True,
+                                       cache_timeout=current_app.config['VIDEO_CACHE_TIMEOUT'])
+        response.accept_ranges = 'bytes'
+        return response
+
+    # 交给nginx(X-Accel-Redirect)或apache/lighttpd(X-Sendfile)传输文件，Range等由前端服务器处理
+    path = safe_join(current_app.config['MOVIE_PATH'], filename)
+    if (path is None) or (not os.path.isfile(path)):
+        abort(404)
+    response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if offload == 'x-accel':
+        response.headers['X-Accel-Redirect'] = current_app.config['VIDEO_ACCEL_PREFIX'] + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = path
+    return response
+
+
+@home.route('/thumb/<size>/<category>/<fmt>/<path:filename>')
+def thumb(size, category, fmt, filename):
+    # 缩略图尚未生成(历史图片或后台任务未完成)时同步生成，之后由静态文件直接提供
+    path = thumbnailer.render(category, filename, size, fmt)
+    if path is None:
+        abort(404)
+    return send_from_directory(os.path.dirname(path), os.path.basename(path))
@@ -0,0 +1,113 @@
+import queue
+import atexit
+import threading
+from collections import defaultdict
+
+from sqlalchemy import event
+
+
+class AuditWriter:
+    # 日志事件先进入内存队列，由后台线程按表批量insert(executemany)
+    # mode='sync'时在调用处直接写入，便于测试
+    def __init__(self, db):
+        self.db = db
+        self.app = None
+        self.mode = 'async'
+        self.policy = 'block'
+        self.batch_size = 500
+        self.interval = 1
+        self.block_timeout = 0.1
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = None
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('AUDIT_MODE', self.mode)
+        self.policy = app.config.get('AUDIT_FULL_POLICY', self.policy)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', self.batch_size)
+        self.interval = app.config.get('AUDIT_FLUSH_INTERVAL', self.interval)
+        self.block_timeout = app.config.get('AUDIT_BLOCK_TIMEOUT', self.block_timeout)
+        self._queue = queue.Queue(maxsize=app.config.get('AUDIT_QUEUE_SIZE', 0))
+        if not event.contains(self.db.session, 'after_commit', self._on_commit):
+            event.listen(self.db.session, 'after_commit', self._on_commit)
+            event.listen(self.db.session, 'after_rollback', self._on_rollback)
+        if (self.mode == 'async') and (self._worker is None):
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+            atexit.register(self.stop)
+
+    def record(self, table, values):
+        if self.mode == 'sync':
+            self._write([(table, values)])
+            return
+        try:
+            if self.policy == 'block':
+                self._queue.put((table, values), timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait((table, values))
+        except queue.Full:
+            # 队列已满: 'sync'策略退回同步写入，其余策略丢弃并计数
+            if self.policy == 'sync':
+                self._write([(table, values)])
+            else:
+                self.dropped += 1
+
+    def record_on_commit(self, table, values):
+        # 随当前事务提交才真正记录，回滚则丢弃
+        self.db.session.info.setdefault('audit_events', []).append((table, values))
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def stop(self):
+        self._stopped.set()
+        if self._worker is not None:
+            self._worker.join(self.interval + 1)
+        self.flush()
+
+    def _on_commit(self, session):
+        for table, values in session.info.pop('audit_events', []):
+            self.record(table, values)
+
+    def _on_rollback(self, session):
+        session.info.pop('audit_events', None)
+
+    def _write(self, batch):
+        rows = defaultdict(list)
+        for table, values in batch:
+            rows[table].append(values)
+        engine = self.db.get_engine(self.app)
+        with engine.begin() as conn:
+            for table, values in rows.items():
+                conn.execute(table.insert(), values)
+        self.written += len(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                self.dropped += len(batch)
+                self.app.logger.exception('audit log write failed')
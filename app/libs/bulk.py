@@ -0,0 +1,149 @@
+import os
+import csv
+import json
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import inspect
+from werkzeug.datastructures import FileStorage
+from werkzeug.security import generate_password_hash
+
+from .enums import AuthEnum, RoleEnum
+
+
+def read_rows(path):
+    # 按扩展名读取csv(首行为列名)或jsonl(每行一个对象)
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _int(value, default=None):
+    return default if value in (None, '') else int(value)
+
+
+def _date(value):
+    if value in (None, ''):
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _datetime(value, default):
+    if value in (None, ''):
+        return default
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+class Rows:
+    # 把导入文件中的一行转换成表的列；同一张表的每一行列名相同，才能拼成一条多行INSERT
+    def __init__(self, password=None, tag_ids=None, hash_password=generate_password_hash):
+        self.now = datetime.now()
+        self.password = password
+        self.hash_password = hash_password
+        self.tag_ids = tag_ids or {}
+        self._hashes = {}
+
+    def _password_hash(self, row):
+        # 优先使用导入文件里已经算好的password_hash，相同的明文只计算一次
+        if row.get('password_hash'):
+            return row['password_hash']
+        password = row.get('password') or self.password
+        if not password:
+            raise ValueError(f'no password for user {row.get("email")}')
+        if password not in self._hashes:
+            self._hashes[password] = self.hash_password(password)
+        return self._hashes[password]
+
+    def _base(self, row):
+        return {'status': True, 'create_time': _datetime(row.get('create_time'), self.now)}
+
+    def users(self, row):
+        return dict(self._base(row), name=row['name'], email=row['email'], phone=row.get('phone') or None,
+                    confirm=bool(_int(row.get('confirm'), 1)), intro=row.get('intro'), avatar=row.get('avatar'),
+                    auth=AuthEnum[row.get('auth') or 'User'], role=RoleEnum[row.get('role') or 'User'],
+                    password=self._password_hash(row))
+
+    def tags(self, row):
+        return dict(self._base(row), name=row['name'])
+
+    def movies(self, row):
+        tag_id = _int(row.get('tag_id')) or self.tag_ids.get(row.get('tag'))
+        return dict(self._base(row), title=row['title'], url=row.get('url'), logo=row.get('logo'),
+                    intro=row.get('intro'), area=row.get('area'), publish_time=_date(row.get('publish_time')),
+                    length=row.get('length'), star=_int(row.get('star')), tag_id=tag_id,
+                    play_num=_int(row.get('play_num'), 0), comment_num=0)
+
+    def previews(self, row):
+        return dict(self._base(row), title=row['title'], logo=row.get('logo'))
+
+    def comments(self, row):
+        return dict(self._base(row), content=row['content'], movie_id=int(row['movie_id']),
+                    user_id=int(row['user_id']))
+
+
+class BulkLoader:
+    # 每批拼成一条INSERT ... VALUES (...), (...)并单独提交；媒体文件用线程池并行复制到内容寻址目录
+    # defer_indexes时先删除表上的普通索引，导入完成后重建(唯一索引保留，用于检查重复)
+    def __init__(self, db, media_store, batch_size=500, workers=4, media_dir=None, defer_indexes=False):
+        self.db = db
+        self.media_store = media_store
+        self.batch_size = batch_size
+        self.workers = workers
+        self.media_dir = media_dir
+        self.defer_indexes = defer_indexes
+        self._copied = {}
+
+    def load(self, model, rows, media=()):
+        # media: ((列名, 保存目录), ...)，返回(行数, 耗时)
+        table = model.__table__
+        dropped = self._drop_indexes(table) if self.defer_indexes else []
+        count = 0
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for batch in batches(rows, self.batch_size):
+                    if self.media_dir and media:
+                        self._copy_media(executor, batch, media)
+                    self.db.session.execute(table.insert().values(batch))
+                    self.db.session.commit()
+                    count += len(batch)
+        finally:
+            for index in dropped:
+                index.create(self.db.engine)
+        return count, time.perf_counter() - start
+
+    def _drop_indexes(self, table):
+        existing = {index['name'] for index in inspect(self.db.engine).get_indexes(table.name)}
+        dropped = [index for index in table.indexes if (not index.unique) and (index.name in existing)]
+        for index in dropped:
+            index.drop(self.db.engine)
+        return dropped
+
+    def _copy_media(self, executor, batch, media):
+        # 同一个源文件只复制一次
+        jobs = [(row, column, up_dir) for row in batch for column, up_dir in media if row.get(column)]
+        keys = list({(row[column], up_dir) for row, column, up_dir in jobs} - set(self._copied))
+        self._copied.update(zip(keys, executor.map(self._copy, keys)))
+        for row, column, up_dir in jobs:
+            row[column] = self._copied[(row[column], up_dir)]
+
+    def _copy(self, key):
+        filename, up_dir = key
+        with open(os.path.join(self.media_dir, filename), 'rb') as f:
+            return self.media_store.save(FileStorage(f, filename=filename), up_dir, track=False)
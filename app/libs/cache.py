@@ -0,0 +1,151 @@
+import time
+import sqlite3
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask_login import current_user
+
+
+class VersionStamp:
+    # 基于SQLite文件的版本号，多个worker进程共享，用于判断进程内缓存是否失效
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, name):
+        row = self._connect().execute('SELECT version FROM versions WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        # 返回递增后的版本号，BEGIN IMMEDIATE保证多个进程同时递增时各自拿到不同的版本号
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR IGNORE INTO versions (name, version) VALUES (?, 0)', (name,))
+            conn.execute('UPDATE versions SET version = version + 1 WHERE name = ?', (name,))
+            version = conn.execute('SELECT version FROM versions WHERE name = ?', (name,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return version
+
+
+class ReferenceCache:
+    # 参考数据(标签、预告等)的读穿透缓存，数据变更时递增共享版本号使所有进程的缓存失效
+    def __init__(self):
+        self.stamp = None
+        self._loaders = {}
+        self._values = {}
+
+    def init_app(self, app):
+        self.stamp = VersionStamp(app.config['REFERENCE_CACHE_PATH'])
+        self._values.clear()
+
+    def loader(self, name):
+        def decorator(f):
+            self._loaders[name] = f
+            return f
+
+        return decorator
+
+    def get(self, name):
+        version = self.stamp.get(name)
+        cached = self._values.get(name)
+        if (cached is not None) and (cached[0] == version):
+            return cached[1]
+        value = self._loaders[name]()
+        self._values[name] = (version, value)
+        return value
+
+    def invalidate(self, name):
+        self._values.pop(name, None)
+        self.stamp.bump(name)
+
+
+class PageCache:
+    # 匿名访问页面的渲染结果缓存(TTL + LRU)，数据变更时通过共享版本号整体失效
+    def __init__(self, name):
+        self.name = name
+        self.stamp = None
+        self.maxsize = 256
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.stamp = VersionStamp(app.config['REFERENCE_CACHE_PATH'])
+        self.maxsize = app.config.get('PAGE_CACHE_SIZE', self.maxsize)
+        self.ttl = app.config.get('PAGE_CACHE_TTL', self.ttl)
+
+    def get(self, key):
+        version = self.stamp.get(self.name)
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                self._items.clear()
+                self._version = version
+            item = self._items.get(key)
+            if (item is None) or (item[0] < now):
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._items.clear()
+        self.stamp.bump(self.name)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0,
+        }
+
+    def cached(self, make_key):
+        # 登录用户看到的页面不同，不走缓存
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if (self.maxsize <= 0) or current_user.is_authenticated:
+                    return f(*args, **kwargs)
+                key = make_key(*args, **kwargs)
+                rv = self.get(key)
+                if rv is None:
+                    rv = f(*args, **kwargs)
+                    if isinstance(rv, str):
+                        self.set(key, rv)
+                return rv
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,103 @@
+import atexit
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func
+
+
+class BufferedCounter:
+    # 在进程内累加计数增量，按阈值或定时批量写回: UPDATE ... SET field = field + n
+    # 写回只在后台线程中进行，达到阈值时唤醒后台线程，请求线程不等待数据库
+    def __init__(self, db, model, fields):
+        self.db = db
+        self.model = model
+        self.fields = fields
+        self.app = None
+        self.threshold = 100
+        self.interval = 5
+        self._pending = defaultdict(int)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._worker = None
+
+    def init_app(self, app):
+        self.app = app
+        self.threshold = app.config.get('COUNTER_FLUSH_THRESHOLD', self.threshold)
+        self.interval = app.config.get('COUNTER_FLUSH_INTERVAL', self.interval)
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+            atexit.register(self.stop)
+
+    def incr(self, ident, field, n=1):
+        if field not in self.fields:
+            raise KeyError(field)
+        with self._lock:
+            self._pending[(ident, field)] += n
+            self._size += n
+            full = self._size >= self.threshold
+        if full:
+            self._wake.set()
+
+    def pending(self, ident, field):
+        with self._lock:
+            return self._pending.get((ident, field), 0)
+
+    def value(self, obj, field):
+        return (getattr(obj, field) or 0) + self.pending(obj.id, field)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(int)
+                self._size = 0
+            if not pending:
+                return 0
+            try:
+                self._write(pending)
+            except Exception:
+                # 写回失败时把增量放回缓冲区，等待下一次刷新
+                with self._lock:
+                    for key, n in pending.items():
+                        self._pending[key] += n
+                        self._size += n
+                raise
+            return len(pending)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(1)
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('counter flush failed')
+
+    def _write(self, pending):
+        table = self.model.__table__
+        engine = self.db.get_engine(self.app)
+        with engine.begin() as conn:
+            for field in self.fields:
+                params = [{'_id': ident, '_n': n} for (ident, key), n in pending.items() if (key == field) and n]
+                if not params:
+                    continue
+                stmt = table.update().where(table.c.id == bindparam('_id')).values(
+                    {field: func.coalesce(table.c[field], 0) + bindparam('_n')}
+                )
+                conn.execute(stmt, params)
+
+    def _run(self):
+        # INTERVAL为0时只在达到阈值时写回
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('counter flush failed')
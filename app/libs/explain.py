@@ -0,0 +1,47 @@
+import re
+
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
+
+EXPLAIN_PREFIXES = {
+    'mysql': 'EXPLAIN',
+    'sqlite': 'EXPLAIN QUERY PLAN',
+    'postgresql': 'EXPLAIN',
+}
+
+
+class Explain(Executable, ClauseElement):
+    # EXPLAIN <select>，参数绑定与原查询一致
+    def __init__(self, statement, prefix):
+        self.statement = statement
+        self.prefix = prefix
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return f'{element.prefix} {compiler.process(element.statement, **kw)}'
+
+
+def explain(conn, statement):
+    # 返回执行计划的每一步: (表, 是否全表扫描, 说明)
+    dialect = conn.dialect.name
+    if dialect not in EXPLAIN_PREFIXES:
+        raise NotImplementedError(f'EXPLAIN is not supported for {dialect}')
+    rows = conn.execute(Explain(statement, EXPLAIN_PREFIXES[dialect])).fetchall()
+    if dialect == 'mysql':
+        return [
+            (row['table'], row['type'] == 'ALL',
+             f"type={row['type']} key={row['key']} rows={row['rows']} {row['Extra'] or ''}".strip())
+            for row in rows
+        ]
+    plan = []
+    for row in rows:
+        detail = row[-1]
+        if dialect == 'sqlite':
+            match = re.match(r'(SCAN|SEARCH) (?:TABLE )?(\w+)', detail)
+            full = bool(match) and (match.group(1) == 'SCAN') and ('INDEX' not in detail)
+        else:
+            match = re.search(r'(Seq Scan|Index Scan|Index Only Scan|Bitmap Heap Scan) on (\w+)', detail)
+            full = bool(match) and (match.group(1) == 'Seq Scan')
+        plan.append((match.group(2) if match else None, full, detail.strip()))
+    return plan
@@ -0,0 +1,68 @@
+from flask import session
+from flask_login import UserMixin
+
+from .cache import VersionStamp
+from .enums import AuthEnum, RoleEnum
+
+SESSION_KEY = '_identity'
+
+
+class Identity(UserMixin):
+    # current_user的快照，只有页面和权限检查用到的字段；访问其他属性(如change_password)时才查询users表
+    def __init__(self, loader, id, name, auth, role, avatar):
+        self._loader = loader
+        self._user = None
+        self.id = id
+        self.name = name
+        self.auth = AuthEnum[auth]
+        self.role = RoleEnum[role]
+        self.avatar = avatar
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = self._loader(self.id)
+        return getattr(self._user, name)
+
+
+class IdentityCache:
+    # 登录用户的快照保存在签名的session cookie中，并记下该用户当时的版本号
+    # 用户资料变更、删除或修改密码时递增版本号(多个worker进程共享)，快照失效后重新查询一次users表
+    def __init__(self):
+        self.stamp = None
+        self.enabled = True
+
+    def init_app(self, app):
+        self.stamp = VersionStamp(app.config['REFERENCE_CACHE_PATH'])
+        self.enabled = app.config.get('IDENTITY_CACHE', self.enabled)
+
+    def load(self, uid, loader):
+        uid = int(uid)
+        if not self.enabled:
+            return loader(uid)
+        version = self.stamp.get(f'user:{uid}')
+        data = session.get(SESSION_KEY)
+        if (data is not None) and (data['id'] == uid) and (data['version'] == version):
+            return Identity(loader, *data['fields'])
+        user = loader(uid)
+        if user is None:
+            session.pop(SESSION_KEY, None)
+            return None
+        self.save(user, version)
+        return user
+
+    def save(self, user, version=None):
+        # 登录时直接保存快照，下一个请求就不用再查询
+        if not self.enabled:
+            return
+        if version is None:
+            version = self.stamp.get(f'user:{user.id}')
+        session[SESSION_KEY] = {
+            'id': user.id,
+            'version': version,
+            'fields': [user.id, user.name, user.auth.name, user.role.name, user.avatar],
+        }
+
+    def invalidate(self, uid):
+        self.stamp.bump(f'user:{uid}')
@@ -0,0 +1,214 @@
+import os
+import time
+import atexit
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import func, event
+from werkzeug.utils import secure_filename
+
+from .upload import StagedFile, save_media
+
+REMOVING_SUFFIX = '.removing'
+
+
+def media_digest(media):
+    # 流式上传/分片上传已经算好了sha256，内存中的小文件在这里读一遍
+    stream = getattr(media, 'stream', None)
+    if isinstance(stream, StagedFile) or (stream is None):
+        return media.sha256
+    sha = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+        sha.update(chunk)
+    stream.seek(0)
+    return sha.hexdigest()
+
+
+def discard_media(media):
+    stream = getattr(media, 'stream', None)
+    if isinstance(stream, StagedFile):
+        stream.close()
+    elif stream is None:
+        media.discard()
+
+
+class MediaStore:
+    # 按内容sha256寻址保存上传文件: <dir>/ab/cd/<sha256><ext>，相同内容只保存一份
+    # 引用计数来自注册的模型字段(User.avatar、Movie.logo/url、Preview.logo)，软删除的记录不算引用
+    # 替换、删除后的旧文件在事务提交后交给后台线程删除，无人引用的文件由media_gc命令(或配置了SWEEP_INTERVAL的进程)清理
+    # 保存时会刷新已有文件的修改时间，RELEASE_GRACE秒内保存过的文件可能属于尚未提交的记录，延后再删除；
+    # 事务回滚时删除本次新写入且无人引用的文件
+    def __init__(self, db):
+        self.db = db
+        self.app = None
+        self.workers = 2
+        self.sweep_interval = 0
+        self.sweep_grace = 3600
+        self.release_grace = 60
+        self._references = {}
+        self._removers = []
+        self._executor = None
+        self._stopped = threading.Event()
+        self._sweeper = None
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('MEDIA_WORKERS', self.workers)
+        self.sweep_interval = app.config.get('MEDIA_SWEEP_INTERVAL', self.sweep_interval)
+        self.sweep_grace = app.config.get('MEDIA_SWEEP_GRACE', self.sweep_grace)
+        self.release_grace = app.config.get('MEDIA_RELEASE_GRACE', self.release_grace)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            atexit.register(self.stop)
+        if not event.contains(self.db.session, 'after_commit', self._on_commit):
+            event.listen(self.db.session, 'after_commit', self._on_commit)
+            event.listen(self.db.session, 'after_rollback', self._on_rollback)
+        if self.sweep_interval and (self._sweeper is None):
+            self._sweeper = threading.Thread(target=self._sweep, daemon=True)
+            self._sweeper.start()
+
+    def register(self, config_key, *columns):
+        self._references.setdefault(config_key, []).extend(columns)
+
+    def on_remove(self, f):
+        # 文件被删除后调用f(up_dir, path)，用于清理缩略图等衍生文件
+        self._removers.append(f)
+        return f
+
+    def save(self, media, up_dir, track=True):
+        # track: 新写入的文件在事务回滚时删除；没有应用上下文的调用方(如批量导入的线程池)传False，孤立文件由media_gc清理
+        digest = media_digest(media)
+        ext = os.path.splitext(secure_filename(media.filename))[-1].lower()
+        path = f'{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+        dst = os.path.join(up_dir, path)
+        try:
+            # 刷新修改时间，正在删除该文件的线程或进程看到后会保留它(见_remove_file)
+            os.utime(dst)
+            discard_media(media)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            save_media(media, dst)
+            os.utime(dst)
+            if track:
+                self.db.session.info.setdefault('media_saves', []).append((up_dir, path))
+        return path
+
+    def columns(self, up_dir):
+        for config_key, columns in self._references.items():
+            if current_app.config[config_key] == up_dir:
+                return columns
+        return []
+
+    def referenced(self, up_dir, path, exclude=None):
+        for column in self.columns(up_dir):
+            query = self.db.session.query(func.count()).filter(column == path, column.class_.status == True)
+            if (exclude is not None) and (column.class_ is exclude.__class__):
+                query = query.filter(column.class_.id != exclude.id)
+            if query.scalar():
+                return True
+        return False
+
+    def collect(self, grace=3600, dry_run=False):
+        # 删除没有任何记录引用的文件；最近grace秒内写入的文件可能属于尚未提交的上传，跳过
+        removed, size = 0, 0
+        deadline = time.time() - grace
+        staging = os.path.abspath(current_app.config['UPLOAD_STAGING_PATH'])
+        for config_key, columns in self._references.items():
+            up_dir = current_app.config[config_key]
+            used = set()
+            for column in columns:
+                query = self.db.session.query(column).filter(column.isnot(None), column.class_.status == True)
+                used.update(value for value, in query.distinct())
+            for root, dirs, files in os.walk(up_dir):
+                dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != staging]
+                for name in files:
+                    if name.endswith(REMOVING_SUFFIX):
+                        continue
+                    full = os.path.join(root, name)
+                    path = os.path.relpath(full, up_dir).replace(os.sep, '/')
+                    try:
+                        stat = os.stat(full)
+                    except FileNotFoundError:
+                        continue
+                    if (path in used) or (stat.st_mtime > deadline):
+                        continue
+                    if dry_run or self._remove_file(up_dir, path, grace):
+                        removed += 1
+                        size += stat.st_size
+        return removed, size
+
+    def release(self, up_dir, path):
+        # 随当前事务提交后异步删除(仍被引用时保留)，回滚则什么都不做
+        if path:
+            self.db.session.info.setdefault('media_releases', []).append((up_dir, path))
+
+    def release_object(self, obj):
+        # 软删除时释放记录引用的所有文件
+        for config_key, columns in self._references.items():
+            for column in columns:
+                if column.class_ is obj.__class__:
+                    self.release(current_app.config[config_key], getattr(obj, column.key))
+
+    def stop(self):
+        self._stopped.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _on_commit(self, session):
+        session.info.pop('media_saves', None)
+        for up_dir, path in session.info.pop('media_releases', []):
+            self._executor.submit(self._remove, up_dir, path)
+
+    def _on_rollback(self, session):
+        session.info.pop('media_releases', None)
+        for up_dir, path in session.info.pop('media_saves', []):
+            self._executor.submit(self._remove, up_dir, path)
+
+    def _remove_file(self, up_dir, path, grace):
+        # 先改名再检查修改时间: save()刷新修改时间发生在改名之前时这里能看到并恢复文件，
+        # 发生在改名之后时save()找不到文件会重新写入，两种情况都不会删掉正在使用的文件
+        # 返回False表示文件在grace秒内保存过而被保留
+        full = os.path.join(up_dir, path)
+        removing = full + REMOVING_SUFFIX
+        try:
+            os.rename(full, removing)
+        except FileNotFoundError:
+            return True
+        if os.stat(removing).st_mtime > time.time() - grace:
+            os.replace(removing, full)
+            return False
+        os.remove(removing)
+        for f in self._removers:
+            f(up_dir, path)
+        return True
+
+    def _remove(self, up_dir, path):
+        with self.app.app_context():
+            try:
+                if self.referenced(up_dir, path) or self._remove_file(up_dir, path, self.release_grace):
+                    return
+            except Exception:
+                self.app.logger.exception('media remove failed: %s', path)
+                return
+        # 刚被保存过，等引用它的记录提交后再检查一次
+        timer = threading.Timer(self.release_grace, self._retry, (up_dir, path))
+        timer.daemon = True
+        timer.start()
+
+    def _retry(self, up_dir, path):
+        if not self._stopped.is_set():
+            self._executor.submit(self._remove, up_dir, path)
+
+    def _sweep(self):
+        while not self._stopped.wait(self.sweep_interval):
+            with self.app.app_context():
+                try:
+                    removed, size = self.collect(grace=self.sweep_grace)
+                except Exception:
+                    self.app.logger.exception('media sweep failed')
+                    continue
+            if removed:
+                self.app.logger.info('media sweep removed %d files, %.1fMB', removed, size / 1024 / 1024)
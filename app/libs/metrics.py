@@ -0,0 +1,165 @@
+import hmac
+import time
+import threading
+from collections import defaultdict, deque
+
+from flask import g, request, has_request_context, Response, abort
+from flask_login import current_user
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUANTILES = (0.5, 0.9, 0.99)
+# 指标名 -> 样本中的下标
+SERIES = (
+    ('request_duration_seconds', 0),
+    ('request_queries', 1),
+    ('request_sql_seconds', 2),
+    ('request_render_seconds', 3),
+)
+
+
+def quantile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class TimedTemplate(Template):
+    # 只统计render_template渲染的顶层模板，include/import不重复计时
+    def render(self, *args, **kwargs):
+        if not has_request_context():
+            return super().render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            g.metrics_render = g.get('metrics_render', 0.0) + time.perf_counter() - start
+
+
+class RequestMetrics:
+    # 按endpoint记录每个请求的SQL条数、SQL耗时、模板渲染耗时和总耗时，保留最近METRICS_SAMPLES个样本计算分位数
+    # 超过METRICS_SLOW_REQUEST秒的请求连同其SQL列表记录到日志
+    def __init__(self):
+        self.app = None
+        self.samples = 1000
+        self.slow = 1.0
+        self.slow_queries = 50
+        self.token = None
+        self.allow = ()
+        self.server_timing = False
+        self._data = defaultdict(self._series)
+        self._totals = defaultdict(lambda: [0, 0.0, 0, 0.0, 0.0])
+        self._lock = threading.Lock()
+
+    def _series(self):
+        return deque(maxlen=self.samples)
+
+    def init_app(self, app):
+        self.app = app
+        self.samples = app.config.get('METRICS_SAMPLES', self.samples)
+        self.slow = app.config.get('METRICS_SLOW_REQUEST', self.slow)
+        self.slow_queries = app.config.get('METRICS_SLOW_QUERIES', self.slow_queries)
+        self.token = app.config.get('METRICS_TOKEN', self.token)
+        self.allow = app.config.get('METRICS_ALLOW', self.allow)
+        self.server_timing = app.config.get('METRICS_SERVER_TIMING', self.server_timing)
+        if not event.contains(Engine, 'before_cursor_execute', self._before_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = []
+        g.metrics_sql = 0.0
+        g.metrics_render = 0.0
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and ('metrics_start' in g):
+            context._metrics_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_metrics_start', None)
+        if (start is None) or (not has_request_context()):
+            return
+        elapsed = time.perf_counter() - start
+        g.metrics_sql += elapsed
+        g.metrics_queries.append((statement, elapsed))
+
+    def _after_request(self, response):
+        # SQL条数和耗时只给登录的管理员看
+        if self.server_timing and ('metrics_start' in g) and current_user.is_authenticated and \
+                current_user.role.is_admin():
+            response.headers['Server-Timing'] = 'db;desc="{}";dur={:.1f}, render;dur={:.1f}'.format(
+                len(g.metrics_queries), g.metrics_sql * 1000, g.metrics_render * 1000)
+        return response
+
+    def _teardown_request(self, error=None):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        queries = g.pop('metrics_queries')
+        sample = (duration, len(queries), g.pop('metrics_sql'), g.pop('metrics_render'))
+        endpoint = request.endpoint or '<unmatched>'
+        with self._lock:
+            self._data[endpoint].append(sample)
+            totals = self._totals[endpoint]
+            totals[0] += 1
+            for i, value in enumerate(sample):
+                totals[i + 1] += value
+        if duration > self.slow:
+            lines = [f'  {elapsed * 1000:.1f}ms {statement}' for statement, elapsed in queries[:self.slow_queries]]
+            if len(queries) > self.slow_queries:
+                lines.append(f'  ... {len(queries) - self.slow_queries} more')
+            self.app.logger.warning('slow request %s %s: %.3fs, %d queries %.3fs, render %.3fs\n%s',
+                                    endpoint, request.path, duration, len(queries), sample[2], sample[3],
+                                    '\n'.join(lines))
+
+    def stats(self):
+        # 后台页面使用: 每个endpoint的请求数与各项分位数
+        with self._lock:
+            data = {endpoint: list(samples) for endpoint, samples in self._data.items()}
+            totals = {endpoint: list(values) for endpoint, values in self._totals.items()}
+        result = []
+        for endpoint in sorted(data):
+            samples = data[endpoint]
+            count = totals[endpoint][0]
+            item = {'endpoint': endpoint, 'count': count,
+                    'queries_avg': totals[endpoint][2] / count if count else 0}
+            for name, index in SERIES:
+                values = [sample[index] for sample in samples]
+                item[name] = [quantile(values, q) for q in QUANTILES]
+            result.append(item)
+        return result
+
+    def authorized(self):
+        # 配置了METRICS_TOKEN时要求Authorization: Bearer <token>，配置了METRICS_ALLOW时要求客户端地址在其中；都未配置时禁止访问
+        if (not self.token) and (not self.allow):
+            return False
+        if self.token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {self.token}'):
+            return False
+        return (not self.allow) or (request.remote_addr in self.allow)
+
+    def export(self):
+        # Prometheus文本格式(summary)
+        if not self.authorized():
+            abort(403)
+        with self._lock:
+            data = {endpoint: list(samples) for endpoint, samples in self._data.items()}
+            totals = {endpoint: list(values) for endpoint, values in self._totals.items()}
+        lines = []
+        for name, index in SERIES:
+            lines.append(f'# TYPE flask_{name} summary')
+            for endpoint in sorted(data):
+                values = sorted(sample[index] for sample in data[endpoint])
+                for q in QUANTILES:
+                    lines.append(f'flask_{name}{{endpoint="{endpoint}",quantile="{q}"}} {quantile(values, q)}')
+                lines.append(f'flask_{name}_sum{{endpoint="{endpoint}"}} {totals[endpoint][index + 1]}')
+                lines.append(f'flask_{name}_count{{endpoint="{endpoint}"}} {totals[endpoint][0]}')
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
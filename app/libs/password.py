@@ -0,0 +1,46 @@
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasher:
+    # 哈希方法和强度可配置(如'pbkdf2:sha256:100000')；存量哈希的参数与配置不同时needs_rehash返回True
+    # 校验交给有界线程池执行(hashlib.pbkdf2_hmac计算时释放GIL)，同时最多WORKERS + QUEUE个校验，超出时verify返回None
+    def __init__(self):
+        self.method = 'pbkdf2:sha256'
+        self.salt_length = 8
+        self.workers = 2
+        self.queue = 32
+        self._prefix = None
+        self._slots = None
+        self._executor = None
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.salt_length = app.config.get('PASSWORD_SALT_LENGTH', self.salt_length)
+        self.workers = app.config.get('PASSWORD_WORKERS', self.workers)
+        self.queue = app.config.get('PASSWORD_QUEUE', self.queue)
+        # 生成一次哈希得到规范化的方法名(带上默认迭代次数)，与存量哈希的前缀比较
+        self._prefix = self.hash('').split('$', 1)[0]
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            atexit.register(self._executor.shutdown, wait=False)
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method, salt_length=self.salt_length)
+
+    def needs_rehash(self, pwhash):
+        return (self._prefix is not None) and (pwhash.split('$', 1)[0] != self._prefix)
+
+    def verify(self, pwhash, password):
+        if self._executor is None:
+            return check_password_hash(pwhash, password)
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            return self._executor.submit(check_password_hash, pwhash, password).result()
+        finally:
+            self._slots.release()
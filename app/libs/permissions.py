@@ -1,203 +1,81 @@
-# from flask import abort
-#
-#
-# class Role:
-#     allow_endpoint = set()
-#     allow_bp = set()
-#     forbidden_bp = set()
-#     forbidden_endpoint = set()
-#
-#     def __init__(self):
-#         self._valid()
-#
-#     def _valid(self):
-#         for rule in self.allow_endpoint:
-#             if (not rule.startswith('/')) or (not rule.endswith('/')):
-#                 abort(404)
-#
-#         for rule in self.forbidden_endpoint:
-#             if (not rule.startswith('/')) or (not rule.endswith('/')):
-#                 abort(404)
-#
-#         for rule in self.allow_bp:
-#             if rule.startswith('/') or rule.endswith('/'):
-#                 abort(404)
-#
-#         for rule in self.forbidden_bp:
-#             if rule.startswith('/') or rule.endswith('/'):
-#                 abort(404)
-#
-#     def __add__(self, other):
-#         self.allow_endpoint += other.allow_endpoint
-#         self.allow_bp += other.allow_bp
-#         self.forbidden_endpoint += other.forbidden_endpoint
-#         return self
-#
-#
-# class User(Role):
-#     allow_endpoint = {
-#         '/login/',
-#         '/logout/',
-#         '/register/',
-#         '/change_password/',
-#         '/user_login_log/list/',
-#     }
-#     allow_bp = {'home'}
-#     forbidden_bp = {'admin'}
-#
-#
-# class Admin(Role):
-#     allow_endpoint = {
-#         '/login/',
-#         '/logout/',
-#         '/register/',
-#         '/change_password/',
-#         '/admin/user/list/',
-#     }
-#     allow_bp = {'home'}
-#
-#
-# class SuperAdmin(Role):
-#     allow_bp = {'user', 'admin', 'home'}
-#
-#
-# class UserAdmin(Role):
-#     allow_endpoint = {
-#         '/admin/user/view/',
-#         '/admin/user/del/',
-#     }
-#
-#     def __init__(self):
-#         self + Admin()
-#         super().__init__()
-#
-#
-# class TagAdmin(Role):
-#     allow_endpoint = {
-#         '/admin/tag/add/',
-#         '/admin/tag/edit/',
-#         '/admin/tag/del/',
-#         '/admin/tag/list/',
-#     }
-#
-#     def __init__(self):
-#         self + Admin()
-#         super().__init__()
-#
-#
-# class MovieAdmin(Role):
-#     allow_endpoint = {
-#         '/admin/movie/add/',
-#         '/admin/movie/edit/',
-#         '/admin/movie/del/',
-#         '/admin/movie/list/',
-#     }
-#
-#     def __init__(self):
-#         self + Admin()
-#         super().__init__()
-#
-#
-# class PreviewAdmin(Role):
-#     allow_endpoint = {
-#         '/admin/preview/add/',
-#         '/admin/preview/edit/',
-#         '/admin/preview/del/',
-#         '/admin/preview/list/',
-#     }
-#
-#     def __init__(self):
-#         self + Admin()
-#         super().__init__()
-#
-#
-# class PermissionAdmin(Role):
-#     allow_endpoint = {
-#         '/admin/permission/add/',
-#         '/admin/permission/edit/',
-#         '/admin/permission/del/',
-#         '/admin/permission/list/',
-#     }
-#
-#     def __init__(self):
-#         self + Admin()
-#         super().__init__()
-#
-
-from functools import wraps
-
-from flask import abort
+from flask import abort, request, current_app
 from flask_login import current_user
 
 from .enums import RoleEnum
 
+# 除普通用户外的所有角色
+ADMIN_ROLES = tuple(role for role in RoleEnum if role is not RoleEnum.User)
 
-def admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role not in [RoleEnum.User]:
-            return f(*args, **kwargs)
-        raise abort(403)
-
-    return decorator
-
-
-def tag_admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role in [RoleEnum.TagAdmin, RoleEnum.SuperAdmin]:
-            return f(*args, **kwargs)
-        raise abort(403)
-
-    return decorator
-
-
-def movie_admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role in [RoleEnum.MovieAdmin, RoleEnum.SuperAdmin]:
-            return f(*args, **kwargs)
-        raise abort(403)
-
-    return decorator
-
-
-def preview_admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role in [RoleEnum.PreviewAdmin, RoleEnum.SuperAdmin]:
-            return f(*args, **kwargs)
-        raise abort(403)
-
-    return decorator
-
-
-def log_admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role in [RoleEnum.LogAdmin, RoleEnum.SuperAdmin]:
-            return f(*args, **kwargs)
-        raise abort(403)
 
-    return decorator
-
-
-def user_admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role in [RoleEnum.UserAdmin, RoleEnum.SuperAdmin]:
-            return f(*args, **kwargs)
-        raise abort(403)
+def roles_required(*roles):
+    # 只在视图上标记允许的角色，由PermissionMatrix在create_app时编译，before_request中统一检查
+    # 多个装饰器叠加时取交集
+    def decorator(f):
+        allowed = frozenset(roles)
+        if hasattr(f, 'required_roles'):
+            allowed &= f.required_roles
+        f.required_roles = allowed
+        return f
 
     return decorator
 
 
-def super_admin_required(f):
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        if current_user.role in [RoleEnum.SuperAdmin]:
-            return f(*args, **kwargs)
-        raise abort(403)
-
-    return decorator
-
+admin_required = roles_required(*ADMIN_ROLES)
+tag_admin_required = roles_required(RoleEnum.TagAdmin, RoleEnum.SuperAdmin)
+movie_admin_required = roles_required(RoleEnum.MovieAdmin, RoleEnum.SuperAdmin)
+preview_admin_required = roles_required(RoleEnum.PreviewAdmin, RoleEnum.SuperAdmin)
+log_admin_required = roles_required(RoleEnum.LogAdmin, RoleEnum.SuperAdmin)
+user_admin_required = roles_required(RoleEnum.UserAdmin, RoleEnum.SuperAdmin)
+super_admin_required = roles_required(RoleEnum.SuperAdmin)
+
+
+class PermissionMatrix:
+    # endpoint -> 允许角色的位图，每个角色占一位；没有标记的endpoint不限制
+    # protected中的蓝图必须给每个视图标记角色，遗漏时编译直接报错而不是放行
+    # init_app之后注册的视图在下一次请求时重新编译
+    def __init__(self, protected=()):
+        self.bits = {role: 1 << i for i, role in enumerate(RoleEnum)}
+        self.protected = frozenset(protected)
+        self.masks = {}
+        self._compiled = 0
+
+    def init_app(self, app):
+        self.compile(app.view_functions)
+        app.before_request(self.check)
+
+    def compile(self, view_functions):
+        unmarked = [
+            endpoint for endpoint, view in view_functions.items()
+            if (endpoint.rpartition('.')[0] in self.protected) and not hasattr(view, 'required_roles')
+        ]
+        if unmarked:
+            raise RuntimeError(f'views without required roles: {", ".join(sorted(unmarked))}')
+        self.masks = {
+            endpoint: self.mask(view.required_roles)
+            for endpoint, view in view_functions.items() if hasattr(view, 'required_roles')
+        }
+        self._compiled = len(view_functions)
+        return self.masks
+
+    def mask(self, roles):
+        mask = 0
+        for role in roles:
+            mask |= self.bits[role]
+        return mask
+
+    def allowed(self, endpoint, role):
+        mask = self.masks.get(endpoint)
+        return (mask is None) or bool(mask & self.bits.get(role, 0))
+
+    def check(self):
+        if len(current_app.view_functions) != self._compiled:
+            self.compile(current_app.view_functions)
+        mask = self.masks.get(request.endpoint)
+        if mask is None:
+            return None
+        # 先于视图上的login_required执行，未登录时同样跳转到登录页
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        if not (mask & self.bits.get(current_user.role, 0)):
+            abort(403)
+        return None
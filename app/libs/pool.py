@@ -0,0 +1,123 @@
+import time
+import threading
+
+from flask import g, has_request_context
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.requests = 0
+        self.request_wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def checkout(self, wait, overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.overflows += overflow
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        # 累计到当前请求，请求结束时由PoolMonitor汇总
+        if has_request_context():
+            g.db_checkouts = g.get('db_checkouts', 0) + 1
+            g.db_wait = g.get('db_wait', 0.0) + wait
+
+    def timeout(self, wait):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def request(self, wait):
+        with self._lock:
+            self.requests += 1
+            self.request_wait_max = max(self.request_wait_max, wait)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'overflows': self.overflows,
+                'timeouts': self.timeouts,
+                'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0,
+                'wait_max': self.wait_max,
+                'requests': self.requests,
+                'request_wait_max': self.request_wait_max,
+            }
+
+
+class MonitoredQueuePool(QueuePool):
+    # 记录取连接的等待时间、使用溢出连接的次数和超时次数
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        event.listen(self, 'connect', lambda *args: self.stats.incr('connects'))
+        event.listen(self, 'invalidate', lambda *args: self.stats.incr('invalidations'))
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeout(time.perf_counter() - start)
+            raise
+        self.stats.checkout(time.perf_counter() - start, self.overflow() > 0)
+        return conn
+
+    def recreate(self):
+        # dispose()后重建连接池时保留统计
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class PoolMonitor:
+    # 汇总每个请求取连接的次数与等待时间，等待超过DB_SLOW_CHECKOUT秒时记录警告
+    def __init__(self, db):
+        self.db = db
+        self.app = None
+        self.slow = 0.1
+
+    def init_app(self, app):
+        self.app = app
+        self.slow = app.config.get('DB_SLOW_CHECKOUT', self.slow)
+        app.teardown_request(self._teardown_request)
+
+    @property
+    def pool(self):
+        return self.db.get_engine(self.app).pool
+
+    def status(self):
+        pool = self.pool
+        status = {'class': pool.__class__.__name__, 'status': pool.status()}
+        if isinstance(pool, QueuePool):
+            status.update(size=pool.size(), checkedin=pool.checkedin(), checkedout=pool.checkedout(),
+                          overflow=pool.overflow())
+        stats = getattr(pool, 'stats', None)
+        if stats is not None:
+            status.update(stats.snapshot())
+        return status
+
+    def _teardown_request(self, error=None):
+        checkouts = g.pop('db_checkouts', 0)
+        wait = g.pop('db_wait', 0.0)
+        stats = getattr(self.pool, 'stats', None)
+        if (stats is None) or (not checkouts):
+            return
+        stats.request(wait)
+        if wait > self.slow:
+            self.app.logger.warning('slow db checkout: %d checkouts waited %.3fs', checkouts, wait)
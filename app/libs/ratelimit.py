@@ -0,0 +1,121 @@
+import math
+import time
+import sqlite3
+import threading
+
+
+def retry_after(start, now, window, previous, count, limit):
+    # 返回最早能放行的整秒数，必须严格越过临界点(hit在估算值>=limit时拒绝)
+    if count >= limit:
+        # 当前窗口已满: 到下一个窗口后本窗口的计数变为previous，还要等它的权重降到limit以下
+        wait = start + window - now + (1 - limit / count) * window
+    else:
+        # 上一个窗口的权重降到足够低时即可放行
+        wait = (1 - (limit - count) / previous) * window - (now - start)
+    return max(math.floor(wait) + 1, 1)
+
+
+class MemoryBackend:
+    # 进程内的滑动窗口计数: 每个key只保存当前和上一个固定窗口的计数，按时间比例估算滑动窗口内的请求数
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        # 未超限时计数并返回0，超限时返回需要等待的秒数
+        now = time.time() if now is None else now
+        start = now - now % window
+        with self._lock:
+            current, count, previous = self._windows.get(key, (start, 0, 0))
+            if current != start:
+                previous = count if current == start - window else 0
+                current, count = start, 0
+            weight = 1 - (now - start) / window
+            if previous * weight + count >= limit:
+                self._windows[key] = (current, count, previous)
+                return retry_after(start, now, window, previous, count, limit)
+            if (key not in self._windows) and (len(self._windows) >= self.maxsize):
+                self._purge(now, window)
+            self._windows[key] = (current, count + 1, previous)
+            return 0
+
+    def _purge(self, now, window):
+        # 清理两个窗口之前就不再活跃的key
+        expired = [key for key, (current, _, _) in self._windows.items() if current < now - 2 * window]
+        for key in expired:
+            del self._windows[key]
+
+
+class SQLiteBackend:
+    # 同一台机器上多个worker进程共享的计数，保存在本地SQLite文件中
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limits '
+                         '(key TEXT PRIMARY KEY, current REAL NOT NULL, count INTEGER NOT NULL, previous INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        start = now - now % window
+        conn = self._connect()
+        # BEGIN IMMEDIATE保证多个进程对同一个key的读改写是串行的
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT current, count, previous FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            current, count, previous = row or (start, 0, 0)
+            if current != start:
+                previous = count if current == start - window else 0
+                current, count = start, 0
+            weight = 1 - (now - start) / window
+            blocked = previous * weight + count >= limit
+            if not blocked:
+                count += 1
+            conn.execute('INSERT OR REPLACE INTO rate_limits (key, current, count, previous) VALUES (?, ?, ?, ?)',
+                         (key, current, count, previous))
+            if row is None:
+                conn.execute('DELETE FROM rate_limits WHERE current < ?', (now - 2 * window,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if blocked:
+            return retry_after(start, now, window, previous, count, limit)
+        return 0
+
+
+class RateLimiter:
+    # RATELIMIT_RULES: 动作 -> [(维度, 次数, 窗口秒数), ...]，例如同一IP每分钟最多登录20次
+    # check在任意一条规则超限时返回需要等待的秒数，否则返回0；backend可替换为任何实现了hit(key, limit, window)的对象
+    def __init__(self):
+        self.enabled = True
+        self.rules = {}
+        self.backend = MemoryBackend()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', self.enabled)
+        self.rules = app.config.get('RATELIMIT_RULES', self.rules)
+        if app.config.get('RATELIMIT_BACKEND', 'memory') == 'sqlite':
+            self.backend = SQLiteBackend(app.config['RATELIMIT_PATH'])
+        else:
+            self.backend = MemoryBackend(app.config.get('RATELIMIT_MAXSIZE', 100000))
+
+    def check(self, action, **scopes):
+        if not self.enabled:
+            return 0
+        for scope, limit, window in self.rules.get(action, ()):
+            value = scopes.get(scope)
+            if value is None:
+                continue
+            wait = self.backend.hit(f'{action}:{scope}:{value}', limit, window)
+            if wait:
+                return wait
+        return 0
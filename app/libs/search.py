@@ -0,0 +1,200 @@
+import re
+import math
+import time
+import threading
+from collections import defaultdict
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from .cache import VersionStamp
+
+CJK_RANGE = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN_RE = re.compile(f'[{CJK_RANGE}]+|[a-z0-9]+')
+CJK_RE = re.compile(f'[{CJK_RANGE}]')
+
+
+def tokenize(text, query=False):
+    # 中文按二元组切分(建索引时额外保留单字以支持单字查询)，英文数字按单词切分
+    tokens = []
+    for run in TOKEN_RE.findall((text or '').lower()):
+        if not CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        if len(run) == 1:
+            tokens.append(run)
+            continue
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        if not query:
+            tokens.extend(run)
+    return tokens
+
+
+class InvertedIndex:
+    def __init__(self, weights):
+        self.weights = weights
+        self._postings = defaultdict(dict)
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, ident, fields):
+        self.remove(ident)
+        scores = defaultdict(float)
+        for field, text in fields.items():
+            for token in tokenize(text):
+                scores[token] += self.weights.get(field, 1)
+        for token, score in scores.items():
+            self._postings[token][ident] = score
+        self._docs[ident] = tuple(scores)
+
+    def remove(self, ident):
+        for token in self._docs.pop(ident, ()):
+            postings = self._postings[token]
+            postings.pop(ident, None)
+            if not postings:
+                del self._postings[token]
+
+    def search(self, key):
+        tokens = set(tokenize(key, query=True))
+        if not tokens:
+            return sorted(self._docs, reverse=True)
+        postings = [self._postings.get(token, {}) for token in tokens]
+        postings.sort(key=len)
+        # 所有词都命中才算匹配，从最短的倒排表开始求交集
+        matched = set(postings[0])
+        for posting in postings[1:]:
+            if not matched:
+                break
+            matched.intersection_update(posting)
+        if not matched:
+            return []
+        total = len(self._docs)
+        idf = [math.log(1 + total / len(posting)) for posting in postings]
+        ranked = [
+            (sum(posting[ident] * weight for posting, weight in zip(postings, idf)), ident)
+            for ident in matched
+        ]
+        ranked.sort(reverse=True)
+        return [ident for _, ident in ranked]
+
+
+class Search:
+    # 可插拔的搜索后端: 'like'沿用数据库ILIKE，'index'使用进程内倒排索引
+    # 索引与共享版本号绑定: 本进程的写入增量更新索引并递增版本号，其他进程(或批量导入)递增的版本号使本进程在后台重建
+    # 同一时间只有一个线程重建，重建期间继续使用旧索引；rebuild_delay内的多次递增合并为一次重建
+    def __init__(self, model, document, weights, like_columns, load_options=()):
+        self.model = model
+        self.document = document
+        self.weights = weights
+        self.like_columns = like_columns
+        self.load_options = load_options
+        self.backend = 'index'
+        self.rebuild_delay = 1
+        self.app = None
+        self.stamp = None
+        self.name = f'search:{model.__tablename__}'
+        self._index = None
+        self._version = None
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = app.config.get('SEARCH_BACKEND', self.backend)
+        self.rebuild_delay = app.config.get('SEARCH_REBUILD_DELAY', self.rebuild_delay)
+        self.stamp = VersionStamp(app.config['REFERENCE_CACHE_PATH'])
+
+    def search(self, key, page, per_page, backend=None):
+        if (backend or self.backend) == 'like':
+            return self._like(key, page, per_page)
+        index = self.index
+        # add/remove在锁内修改倒排表，读取同样在锁内
+        with self._lock:
+            ids = index.search(key)
+        start = (page - 1) * per_page
+        page_ids = ids[start:start + per_page]
+        items = []
+        if page_ids:
+            # 一次查询取回当前页，再按排名顺序排列
+            objs = {obj.id: obj for obj in self.model.query.filter(self.model.id.in_(page_ids))}
+            items = [objs[ident] for ident in page_ids if ident in objs]
+        return Pagination(None, page, per_page, len(ids), items)
+
+    @property
+    def index(self):
+        version = self.stamp.get(self.name)
+        with self._lock:
+            if (self._index is not None) and (self._version >= version):
+                return self._index
+            if self._index is not None:
+                # 已过期: 交给后台线程重建，本次返回旧索引
+                if not self._rebuilding:
+                    self._rebuilding = True
+                    threading.Thread(target=self._rebuild_later, daemon=True).start()
+                return self._index
+        # 第一次搜索时还没有索引，只能同步构建；并发的请求等待同一次构建
+        with self._build_lock:
+            if self._index is None:
+                self.rebuild()
+        return self._index
+
+    def _rebuild_later(self):
+        try:
+            while True:
+                time.sleep(self.rebuild_delay)
+                with self.app.app_context():
+                    self.rebuild()
+                # 重建期间又有递增时再重建一次
+                with self._lock:
+                    if self._version >= self.stamp.get(self.name):
+                        self._rebuilding = False
+                        return
+        except Exception:
+            self.app.logger.exception('search index rebuild failed')
+            with self._lock:
+                self._rebuilding = False
+
+    def rebuild(self):
+        # 先读版本号再查询，重建期间其他写入递增的版本号会使下次搜索再次重建；在锁外构建，完成后整体替换
+        version = self.stamp.get(self.name)
+        index = InvertedIndex(self.weights)
+        query = self.model.query.filter_by().options(*[joinedload(attr) for attr in self.load_options])
+        for obj in query.yield_per(1000):
+            index.add(obj.id, self.document(obj))
+        with self._lock:
+            if (self._index is None) or (self._version < version):
+                self._index, self._version = index, version
+        return len(index)
+
+    def invalidate(self):
+        # 绕过模型钩子批量写入后调用，所有进程的索引在下次搜索时重建
+        self.stamp.bump(self.name)
+
+    def add(self, obj):
+        self._update(obj.id, self.document(obj))
+
+    def remove(self, obj):
+        self._update(obj.id, None)
+
+    def _update(self, ident, fields):
+        # 在锁内递增版本号，本进程的搜索不会在递增之后、更新之前看到版本不一致而重建
+        with self._lock:
+            version = self.stamp.bump(self.name)
+            # 只有索引在这次递增之前是最新的才增量更新，否则等待重建
+            if (self._index is None) or (self._version != version - 1):
+                return
+            if fields is None:
+                self._index.remove(ident)
+            else:
+                self._index.add(ident, fields)
+            self._version = version
+
+    def _like(self, key, page, per_page):
+        query = self.model.query.filter_by().filter(
+            or_(*[column.ilike(f'%{key}%') for column in self.like_columns])
+        )
+        return query.paginate(page=page, per_page=per_page)
@@ -0,0 +1,158 @@
+import os
+import atexit
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import url_for
+from sqlalchemy import event
+from werkzeug.security import safe_join
+
+from .upload import publish
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def render_thumbnail(src, dst, box, fmt='jpeg'):
+    # 在进程池中执行: 高度为None时按宽度等比缩放，否则居中裁剪到box；先写临时文件再重命名
+    if os.path.exists(dst):
+        return dst
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as image:
+        image = image.convert('RGB')
+        width, height = box
+        if height is None:
+            image = image.resize((width, max(image.height * width // image.width, 1)), Image.LANCZOS)
+        else:
+            image = ImageOps.fit(image, box, Image.LANCZOS)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, fmt.upper(), quality=85)
+            publish(tmp, dst)
+        except Exception:
+            os.remove(tmp)
+            raise
+    return dst
+
+
+class Thumbnailer:
+    # 上传图片后在进程池中生成固定尺寸的缩略图(jpeg/webp)，保存为THUMBNAIL_PATH/<size>/<dir>/<文件名>.<ext>
+    # 已有的历史图片在第一次访问时由home.thumb按需生成；未安装Pillow时直接使用原图
+    # 上传时通过submit_on_commit随事务提交才生成，回滚的记录不会留下缩略图
+    def __init__(self, db):
+        self.db = db
+        self.app = None
+        self.path = None
+        self.dir = None
+        self.sizes = {}
+        self.workers = 2
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config['THUMBNAIL_PATH']
+        self.dir = app.config['THUMBNAIL_DIR']
+        self.sizes = app.config['THUMBNAIL_SIZES']
+        self.workers = app.config.get('THUMBNAIL_WORKERS', self.workers)
+        app.add_template_global(self.url, 'thumb_url')
+        if not self.enabled:
+            app.logger.warning('Pillow is not installed, thumbnails are disabled')
+        if not event.contains(self.db.session, 'after_commit', self._on_commit):
+            event.listen(self.db.session, 'after_commit', self._on_commit)
+            event.listen(self.db.session, 'after_rollback', self._on_rollback)
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 进程池在已有后台线程(审计、计数、媒体清理等)之后才创建，fork出的子进程可能继承被占用的锁，改用spawn
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                atexit.register(self._executor.shutdown, wait=False)
+            return self._executor
+
+    def _category(self, up_dir):
+        for category in self.sizes:
+            if os.path.join(self.app.config['UP_DIR'], category) == up_dir:
+                return category
+        return None
+
+    def _paths(self, category, filename, size, fmt):
+        if (not self.enabled) or (fmt not in FORMAT_EXTENSIONS) or (size not in self.sizes.get(category, {})):
+            return None
+        if os.path.splitext(filename)[-1].lower() not in IMAGE_EXTENSIONS:
+            return None
+        src = safe_join(os.path.join(self.app.config['UP_DIR'], category), filename)
+        dst = safe_join(self.path, size, category, f'{filename}.{FORMAT_EXTENSIONS[fmt]}')
+        if (src is None) or (dst is None):
+            return None
+        return src, dst
+
+    def url(self, category, filename, size, fmt='jpeg'):
+        # 模板中使用: 缩略图已生成时返回静态文件地址，否则返回按需生成的地址；不支持的格式返回None
+        paths = self._paths(category, filename, size, fmt)
+        if paths is None:
+            if fmt != 'jpeg':
+                return None
+            return url_for('static', filename=f'uploads/{category}/{filename}')
+        if os.path.exists(paths[1]):
+            return url_for('static', filename=f'uploads/{self.dir}/{size}/{category}/{filename}.{FORMAT_EXTENSIONS[fmt]}')
+        return url_for('home.thumb', size=size, category=category, fmt=fmt, filename=filename)
+
+    def submit(self, up_dir, filename):
+        category = self._category(up_dir)
+        if category is None:
+            return
+        for size, box in self.sizes[category].items():
+            for fmt in FORMAT_EXTENSIONS:
+                paths = self._paths(category, filename, size, fmt)
+                if paths is not None:
+                    self.executor.submit(render_thumbnail, *paths, box, fmt).add_done_callback(self._done)
+
+    def submit_on_commit(self, up_dir, filename):
+        self.db.session.info.setdefault('thumbnails', []).append((up_dir, filename))
+
+    def render(self, category, filename, size, fmt):
+        # 同步生成，返回缩略图路径；原图不存在或参数不合法时返回None
+        paths = self._paths(category, filename, size, fmt)
+        if (paths is None) or (not os.path.isfile(paths[0])):
+            return None
+        return render_thumbnail(*paths, self.sizes[category][size], fmt)
+
+    def discard(self, up_dir, filename):
+        category = self._category(up_dir)
+        if category is None:
+            return
+        for size in self.sizes[category]:
+            for fmt in FORMAT_EXTENSIONS:
+                paths = self._paths(category, filename, size, fmt)
+                if (paths is not None) and os.path.exists(paths[1]):
+                    os.remove(paths[1])
+
+    def _on_commit(self, session):
+        # 数据已经提交，提交任务失败只记录日志，缩略图之后由home.thumb按需生成
+        for up_dir, filename in session.info.pop('thumbnails', []):
+            try:
+                self.submit(up_dir, filename)
+            except Exception:
+                self.app.logger.exception('thumbnail submit failed: %s', filename)
+
+    def _on_rollback(self, session):
+        session.info.pop('thumbnails', None)
+
+    def _done(self, future):
+        if future.exception() is not None:
+            self.app.logger.error('thumbnail failed: %s', future.exception())
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from flask import Request, current_app
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _file_mode():
+    # 与FileStorage.save(open(..., 'wb'))创建的文件权限一致，nginx等前端服务器才能读取
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+FILE_MODE = _file_mode()
+
+
+def publish(src, dst):
+    # mkstemp创建的暂存文件权限为0600，重命名到上传目录之前改为普通文件的权限
+    os.chmod(src, FILE_MODE)
+    os.replace(src, dst)
+
+
+class StagedFile:
+    # 上传内容直接写入UP_DIR下的暂存文件并同时计算sha256，保存时只需重命名，不再二次拷贝
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self._file = os.fdopen(fd, 'wb+')
+        self._hash = hashlib.sha256()
+        self._committed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def commit(self, dst):
+        self._file.close()
+        publish(self.path, dst)
+        self._committed = True
+
+    def close(self):
+        self._file.close()
+        if not self._committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        threshold = current_app.config['UPLOAD_STREAM_THRESHOLD']
+        if (filename is None) or ((total_content_length is not None) and (total_content_length < threshold)):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return StagedFile(current_app.config['UPLOAD_STAGING_PATH'])
+
+
+def save_media(media, dst):
+    # media为FileStorage或ChunkedUpload
+    stream = getattr(media, 'stream', None)
+    if isinstance(stream, StagedFile):
+        stream.commit(dst)
+    else:
+        media.save(dst)
+
+
+class ChunkedUpload:
+    # 可续传的分片上传会话，数据与元信息都保存在暂存目录中，多个worker进程共享
+    # 写入时对.part文件加排他锁(flock)，同一会话的并发PUT只有一个能写入，其余按offset不一致处理
+    def __init__(self, directory, upload_id, meta):
+        self.upload_id = upload_id
+        self.filename = meta['filename']
+        self.size = meta['size']
+        self.part_path = os.path.join(directory, f'{upload_id}.part')
+        self.meta_path = os.path.join(directory, f'{upload_id}.json')
+
+    @classmethod
+    def create(cls, directory, filename, size):
+        os.makedirs(directory, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        meta = {'filename': filename, 'size': size}
+        upload = cls(directory, upload_id, meta)
+        with open(upload.meta_path, 'w') as f:
+            json.dump(meta, f)
+        open(upload.part_path, 'wb').close()
+        return upload
+
+    @classmethod
+    def load(cls, directory, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            return None
+        try:
+            with open(os.path.join(directory, f'{upload_id}.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        upload = cls(directory, upload_id, meta)
+        if not os.path.exists(upload.part_path):
+            return None
+        return upload
+
+    @property
+    def offset(self):
+        return os.path.getsize(self.part_path)
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    @staticmethod
+    def expire(directory, max_age):
+        # 删除超过max_age秒没有写入的会话和暂存文件，返回删除的文件数
+        removed = 0
+        deadline = time.time() - max_age
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if os.path.isfile(path) and (os.path.getmtime(path) < deadline):
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def write(self, offset, stream, chunk_size):
+        with open(self.part_path, 'r+b') as f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise ValueError('upload in progress')
+            # 持有锁之后再检查offset，检查与写入之间不会有其他请求追加
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise ValueError(f'offset mismatch, expected {current}')
+            f.seek(offset)
+            while self.size > f.tell():
+                chunk = stream.read(min(chunk_size, self.size - f.tell()))
+                if not chunk:
+                    break
+                f.write(chunk)
+        # 会话按修改时间过期，续传时一并刷新元信息文件
+        os.utime(self.meta_path)
+        return self.offset
+
+    @property
+    def sha256(self):
+        sha = hashlib.sha256()
+        with open(self.part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def save(self, dst):
+        if not self.complete:
+            raise ValueError('upload is not complete')
+        publish(self.part_path, dst)
+        os.remove(self.meta_path)
+
+    def discard(self):
+        for path in (self.part_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
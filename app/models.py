@@ -1,52 +1,280 @@
-import os
 import abc
+import time
+import random
 from datetime import datetime
+from functools import partial
 from contextlib import contextmanager
 
-from flask import current_app, request, flash, abort
-from flask_sqlalchemy import SQLAlchemy, BaseQuery
-from sqlalchemy import Column, ForeignKey
+from flask import current_app, request, flash, abort, session, has_request_context
+from flask_sqlalchemy import SQLAlchemy, BaseQuery, SignallingSession, get_state
+from sqlalchemy import Column, ForeignKey, Index, UniqueConstraint, and_, or_, func, event, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import Integer, DateTime, SmallInteger, String, Boolean, Text, Date, BigInteger, Enum
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import relationship
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import relationship, joinedload, selectinload, subqueryload, contains_eager, sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import Select
 from flask_login import LoginManager, UserMixin, current_user
 
-from app.libs.utils import gen_filename
+from app.libs.counter import BufferedCounter
+from app.libs.search import Search
+from app.libs.cache import ReferenceCache, PageCache
+from app.libs.audit import AuditWriter
+from app.libs.upload import ChunkedUpload
+from app.libs.media import MediaStore
+from app.libs.thumbnail import Thumbnailer
+from app.libs.explain import explain
+from app.libs.pool import MonitoredQueuePool, PoolMonitor
+from app.libs.metrics import RequestMetrics
+from app.libs.identity import IdentityCache
+from app.libs.permissions import PermissionMatrix
+from app.libs.password import PasswordHasher
+from app.libs.ratelimit import RateLimiter
 from .libs.enums import AuthEnum, RoleEnum, OperatorEnum
 
 login_manager = LoginManager()
+reference_cache = ReferenceCache()
+index_cache = PageCache('movies')
+request_metrics = RequestMetrics()
+identity_cache = IdentityCache()
+# admin蓝图的视图必须标记允许的角色
+permission_matrix = PermissionMatrix(protected=('admin',))
+password_hasher = PasswordHasher()
+rate_limiter = RateLimiter()
+
+LOADER_STRATEGIES = {
+    'joined': joinedload,
+    'selectin': selectinload,
+    'subquery': subqueryload,
+    'contains': contains_eager,
+}
+
+# 视图中热点列表查询的构造函数，manage.py explain_queries用示例参数构造后逐个EXPLAIN检查全表扫描
+LIST_QUERIES = {}
+
+
+def list_query(name, **sample):
+    # 可叠加使用，为同一个构造函数注册多组示例参数
+    def decorator(f):
+        LIST_QUERIES[name] = partial(f, **sample)
+        return f
+
+    return decorator
+
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(obj):
+    return f'{obj.create_time.strftime(CURSOR_TIME_FORMAT)}.{obj.id}'
+
+
+def decode_cursor(cursor):
+    try:
+        create_time, ident = cursor.split('.')
+        return datetime.strptime(create_time, CURSOR_TIME_FORMAT), int(ident)
+    except ValueError:
+        abort(404)
+
+
+class KeysetPagination:
+    # 与flask_sqlalchemy的Pagination对应，模板根据keyset属性渲染上一页/下一页游标
+    keyset = True
+
+    def __init__(self, query, page, per_page, items, has_prev, has_next, total=None):
+        self.query = query
+        self.page = page
+        self.per_page = per_page
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.total = total
+        self.args = {}
+
+    @property
+    def prev_num(self):
+        return max(self.page - 1, 1)
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self.items[0]) if self.items else None
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.items[-1]) if self.items else None
+
+
+class RoutingSession(SignallingSession):
+    # 配置了只读副本时，请求中的SELECT发往随机一个副本；flush、auto_commit块内以及写入后的一段时间(读己之写)使用主库
+    # 请求之外的后台任务和管理命令(媒体引用检查、计数校正等)依赖最新数据，始终读主库
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        self.replicas = get_state(self.app).replicas
+        if self.replicas:
+            event.listen(self, 'after_flush', self._stick_to_primary)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replicas and isinstance(clause, Select) and not self._use_primary():
+            return self.db.get_engine(self.app, bind=random.choice(self.replicas))
+        return super().get_bind(mapper, clause)
+
+    def _use_primary(self):
+        if self._flushing or self.info.get('primary') or (not has_request_context()):
+            return True
+        return session.get('_db_primary_until', 0) > time.time()
+
+    def _stick_to_primary(self, db_session, flush_context):
+        # 本次请求剩余的查询以及该用户随后STICKY秒内的请求都读主库
+        self.info['primary'] = True
+        if has_request_context():
+            session['_db_primary_until'] = time.time() + self.app.config['SQLALCHEMY_REPLICA_STICKY']
 
 
 class SubSQLAlchemy(SQLAlchemy):
+    def init_app(self, app):
+        # 只读副本作为flask_sqlalchemy的bind注册，复用连接池配置；副本上没有映射表，create_all不会建表
+        replicas = app.config.setdefault('SQLALCHEMY_REPLICAS', [])
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update({f'replica{i}': uri for i, uri in enumerate(replicas)})
+        app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+        get_state(app).replicas = [f'replica{i}' for i in range(len(replicas))]
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
     @contextmanager
     def auto_commit(self):
         try:
+            self.session.info['primary'] = True
             yield
             self.session.commit()
         except Exception as err:
             self.session.rollback()
             raise err
 
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        options['pool_pre_ping'] = app.config.get('SQLALCHEMY_POOL_PRE_PING', False)
+        if (options.get('pool_size') == 0) and ('poolclass' not in options):
+            # QueuePool把pool_size=0当作不限大小，这里改为每次新建连接、用完即关闭
+            options['poolclass'] = NullPool
+        if 'poolclass' in options:
+            # SQLite内存库(StaticPool)或未配置连接池(NullPool)时不支持以下参数
+            for key in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(key, None)
+        else:
+            options['poolclass'] = MonitoredQueuePool
+            if info.drivername == 'sqlite':
+                # 连接池中的SQLite连接会被不同线程取用(后台写入、计数刷新等)
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+
 
 class SubQuery(BaseQuery):
-    def filter_by(self, use_base=False, **kwargs):
-        if not use_base and ('status' not in kwargs.keys()):
-            kwargs.update({'status': True})
-        return super().filter_by(**kwargs)
+    # 软删除过滤(status = 1)在编译SQL时统一加入，关系的延迟加载同样生效；需要包含已删除数据时使用with_deleted()
+    _with_deleted = False
 
-    def get_or_404(self, ident):
-        obj = super().get_or_404(ident)
-        if obj.status:
-            return obj
-        abort(404)
+    def with_deleted(self):
+        query = self._clone()
+        query._with_deleted = True
+        return query
 
-    def first_or_404(self):
-        # 避免取出已经被软删除的数据
-        return super().filter_by().first_or_404()
+    def get_or_404(self, ident):
+        # 不在session中时status条件随主键查询一起下推到SQL，已在session中的对象(例如刚被删除)再检查一次
+        obj = self.get(ident)
+        if (obj is None) or (not obj.status):
+            abort(404)
+        return obj
+
+    def load_profile(self, name=None):
+        # 按端点声明的关系预加载方案(模型的__load_profiles__)，避免模板访问关系属性时产生N+1查询
+        if name is None:
+            name = request.endpoint
+        cls = self._mapper_zero().class_
+        profile = getattr(cls, '__load_profiles__', {}).get(name, {})
+        options = [LOADER_STRATEGIES[strategy](attr) for attr, strategy in profile.items()]
+        if not options:
+            return self
+        return self.options(*options)
+
+    def seek(self, page=1, per_page=None, after=None, before=None, desc=True, count=None):
+        # 基于(create_time, id)的keyset分页，避免OFFSET扫描和COUNT(*)
+        if per_page is None:
+            per_page = current_app.config['PER_PAGE']
+        if count is None:
+            count = current_app.config['PAGINATION_APPROXIMATE_COUNT']
+        if (after is None) and (before is None):
+            after = request.args.get('after')
+            before = request.args.get('before')
+        backward = before is not None
+        # 向前翻页时反向扫描，取完再倒序
+        older = desc != backward
+        cls = self._mapper_zero().class_
+        query = self.order_by(None)
+        cursor = before if backward else after
+        if cursor:
+            create_time, ident = decode_cursor(cursor)
+            if older:
+                clause = or_(cls.create_time < create_time, and_(cls.create_time == create_time, cls.id < ident))
+            else:
+                clause = or_(cls.create_time > create_time, and_(cls.create_time == create_time, cls.id > ident))
+            query = query.filter(clause)
+        if older:
+            order = (cls.create_time.desc(), cls.id.desc())
+        else:
+            order = (cls.create_time.asc(), cls.id.asc())
+        items = query.order_by(*order).limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backward:
+            items.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = bool(cursor), more
+        total = self.order_by(None).approximate_count() if count else None
+        return KeysetPagination(self, page, per_page, items, has_prev, has_next, total=total)
+
+    def approximate_count(self):
+        # MySQL下使用EXPLAIN估算的行数代替COUNT(*)，其他数据库退回精确计数
+        mapper = self._mapper_zero()
+        bind = self.session.get_bind(mapper=mapper)
+        if bind.dialect.name != 'mysql':
+            return self.count()
+        compiled = self.statement.compile(dialect=bind.dialect)
+        row = self.session.connection(mapper=mapper).execute(f'EXPLAIN {compiled}', compiled.params).first()
+        return row['rows'] if row is not None else 0
+
+    def explain(self):
+        mapper = self._mapper_zero()
+        return explain(self.session.connection(mapper=mapper), self.statement)
+
+
+@event.listens_for(SubQuery, 'before_compile', retval=True)
+def filter_deleted(query):
+    # 刷新已加载对象的过期属性(例如软删除提交之后)不过滤
+    if query._with_deleted or (query._refresh_state is not None):
+        return query
+    criteria = []
+    for desc in query.column_descriptions:
+        status = getattr(desc['entity'], 'status', None)
+        if status is not None:
+            criteria.append(status == True)
+    if not criteria:
+        return query
+    # enable_assertions(False): 已设置limit/offset的查询也允许追加条件
+    return query.enable_assertions(False).filter(*criteria)
 
 
 db = SubSQLAlchemy(query_class=SubQuery)
+audit_writer = AuditWriter(db)
+media_store = MediaStore(db)
+thumbnailer = Thumbnailer(db)
+pool_monitor = PoolMonitor(db)
 
 
 class Base(db.Model):
@@ -70,12 +298,18 @@ class Base(db.Model):
 
     def delete(self, record_log=True):
         with db.auto_commit():
-            # 软删除
-            self.status = False
+            self._soft_delete()
             # db.session.delete(self)
+            media_store.release_object(self)
             self._log(operator=OperatorEnum.DELETE, record_log=record_log)
+            self._before_commit(operator=OperatorEnum.DELETE)
+        self._after_commit(operator=OperatorEnum.DELETE)
         flash(f'删除成功', 'message')
 
+    def _soft_delete(self):
+        # 软删除
+        self.status = False
+
     def set_attrs(self, form, ignore_fields):
         ignore_fields.append('id')
         for key, value in form.data.items():
@@ -83,15 +317,19 @@ class Base(db.Model):
                 setattr(self, key, value)
 
     def _upload_media(self, field, up_dir, add=True):
-        path = gen_filename(field.data)
-        if not add:
-            data = getattr(self, field.name)
-            if data:
-                media_path = os.path.join(up_dir, data)
-                if os.path.exists(media_path):
-                    os.remove(media_path)
+        media = field.data
+        if isinstance(media, str):
+            # 分片上传完成后提交的是upload_id
+            media = ChunkedUpload.load(current_app.config['UPLOAD_STAGING_PATH'], media)
+            if (media is None) or not media.complete:
+                abort(404)
+        path = media_store.save(media, up_dir)
+        data = getattr(self, field.name)
+        if (not add) and (data != path):
+            # 旧文件在提交成功后由后台线程删除，相同内容的文件可能被其他记录共用，没有其他引用时才删除
+            media_store.release(up_dir, data)
+        thumbnailer.submit_on_commit(up_dir, path)
         setattr(self, field.name, path)
-        field.data.save(os.path.join(up_dir, path))
 
     def _can_operator(self, form, operator=OperatorEnum.ADD):
         return True
@@ -99,19 +337,58 @@ class Base(db.Model):
     def _handle_media_field(self, form, add=True):
         return []
 
+    # 与数据变更在同一事务中执行的钩子，用于维护冗余计数等
+    def _before_commit(self, operator=OperatorEnum.ADD):
+        pass
+
+    # 提交成功后的钩子，用于同步索引、缓存等进程内状态
+    def _after_commit(self, operator=OperatorEnum.ADD):
+        pass
+
+    def _unique_message(self, err):
+        # 根据违反的唯一约束找到对应的提示: MySQL/PostgreSQL的错误中带约束名，SQLite带"表.列"
+        detail = str(err.orig)
+        table = self.__table__
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint):
+                continue
+            columns = [f'{table.name}.{column.name}' for column in constraint.columns]
+            if (constraint.name in detail) or all(column in detail for column in columns):
+                return getattr(self, '__unique_messages__', {}).get(constraint.name)
+        return None
+
     def _upsert(self, form=None, operator=OperatorEnum.ADD, add=True, record_log=True):
         if not self._can_operator(form=form, operator=operator):
             return False
         ignore_fields = self._handle_media_field(form=form, add=add)
         if form is not None:
             self.set_attrs(form, ignore_fields=ignore_fields)
-        with db.auto_commit():
-            db.session.add(self)
-            self._log(operator=operator, record_log=record_log)
+        # 唯一性由数据库约束保证，不再预先查询
+        try:
+            with db.auto_commit():
+                db.session.add(self)
+                self._log(operator=operator, record_log=record_log)
+                self._before_commit(operator=operator)
+        except IntegrityError as err:
+            message = self._unique_message(err)
+            if message is None:
+                raise
+            flash(message, 'error')
+            return False
+        self._after_commit(operator=operator)
         flash(f'{OperatorEnum.operator_str(operator)}成功', 'message')
         return True
 
 
+class Tombstone:
+    # 唯一约束包含tombstone列: 正常记录为0，软删除后为自身id，已删除的记录不再占用唯一值
+    tombstone = Column(Integer, nullable=False, default=0)
+
+    def _soft_delete(self):
+        super()._soft_delete()
+        self.tombstone = self.id
+
+
 class BaseLog(Base):
     __abstract__ = True
     ip = Column(String(20))
@@ -123,7 +400,7 @@ class BaseLog(Base):
 
     @declared_attr
     def user_id(cls):
-        return Column(Integer, ForeignKey('users.id'))
+        return Column(Integer, ForeignKey('users.id'), index=True)
 
     # override
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
@@ -133,12 +410,40 @@ class BaseLog(Base):
         with db.auto_commit():
             db.session.add(self)
 
+    @classmethod
+    def record(cls, on_commit=False, **kwargs):
+        # 交给audit_writer异步批量写入，不占用当前请求的事务
+        values = {
+            'user_id': current_user.id,
+            'ip': request.remote_addr,
+            'create_time': datetime.now(),
+            'status': True,
+        }
+        values.update(kwargs)
+        if on_commit:
+            audit_writer.record_on_commit(cls.__table__, values)
+        else:
+            audit_writer.record(cls.__table__, values)
+
     def __repr__(self):
         return f'{self.__class__} {self.id!r}'
 
 
-class User(UserMixin, Base):
+class User(UserMixin, Tombstone, Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # 登录按email查找；日志列表按auth连接users
+        Index('ix_users_email_status', 'email', 'status'),
+        Index('ix_users_auth_status', 'auth', 'status'),
+        UniqueConstraint('email', 'tombstone', name='uq_users_email'),
+        UniqueConstraint('name', 'tombstone', name='uq_users_name'),
+        UniqueConstraint('phone', 'tombstone', name='uq_users_phone'),
+    )
+    __unique_messages__ = {
+        'uq_users_email': '邮箱已被注册',
+        'uq_users_name': '昵称被占用',
+        'uq_users_phone': '手机已经被使用',
+    }
     name = Column(String(20), nullable=False)
     email = Column(String(50), nullable=False)
     phone = Column(String(20))
@@ -156,8 +461,7 @@ class User(UserMixin, Base):
 
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
         if record_log:
-            op_log = OpLog(f'{OperatorEnum.operator_str(operator)}用户{self.name}')
-            db.session.add(op_log)
+            OpLog.record(reason=f'{OperatorEnum.operator_str(operator)}用户{self.name}', on_commit=True)
 
     @property
     def password(self):
@@ -166,13 +470,23 @@ class User(UserMixin, Base):
 
     @password.setter
     def password(self, password):
-        self._password = generate_password_hash(password)
+        self._password = password_hasher.hash(password)
 
     def check_password(self, new_password):
-        return check_password_hash(self._password, new_password)
+        # 校验排队已满时返回None
+        ok = password_hasher.verify(self._password, new_password)
+        if ok and password_hasher.needs_rehash(self._password):
+            # 哈希参数调整后，在密码校验通过时按新参数重新哈希
+            with db.auto_commit():
+                self.password = new_password
+        return ok
 
     def change_password(self, form, record_log=True):
-        if not self.check_password(form.old_password.data):
+        ok = self.check_password(form.old_password.data)
+        if ok is None:
+            flash('请求过多，请稍后再试', 'error')
+            return False
+        if not ok:
             flash('旧密码错误', 'error')
             return False
         if form.new_password.data == form.old_password.data:
@@ -182,38 +496,42 @@ class User(UserMixin, Base):
         with db.auto_commit():
             self.password = form.new_password.data
             if record_log:
-                op_log = OpLog(f'修改密码')
-                db.session.add(op_log)
+                OpLog.record(reason='修改密码', on_commit=True)
+        identity_cache.invalidate(self.id)
         flash('密码已更新', 'message')
         return True
 
+    def _after_commit(self, operator=OperatorEnum.ADD):
+        # 资料变更或删除后使session中的快照失效
+        if operator != OperatorEnum.ADD:
+            identity_cache.invalidate(self.id)
+
     def _handle_media_field(self, form, add=True):
         if (form.avatar.data is not None) and (form.avatar.data != ''):
             self._upload_media(form.avatar, current_app.config['AVATAR_PATH'], add=add)
         return super()._handle_media_field(form=form, add=add) + ['avatar']
 
-    def _can_operator(self, form, operator=OperatorEnum.ADD):
-        if operator == OperatorEnum.UPDATE:
-            if (self.name != form.name.data) and self.__class__.query.filter_by(email=form.email.data).first():
-                flash('用户名已被占用', 'error')
-                return False
-        else:
-            if self.__class__.query.filter_by(email=form.email.data).first():
-                flash('用户名已被占用', 'error')
-                return False
-        return True
-
 
 class UserLog(BaseLog):
     __tablename__ = 'user_logs'
+    # 查询已join(User)，直接复用连接结果填充user
+    __load_profiles__ = {
+        'admin.user_login_log_list': {'user': 'contains'},
+    }
 
 
 class AdminLog(BaseLog):
     __tablename__ = 'admin_logs'
+    __load_profiles__ = {
+        'admin.admin_login_log_list': {'user': 'contains'},
+    }
 
 
 class OpLog(BaseLog):
     __tablename__ = 'op_logs'
+    __load_profiles__ = {
+        'admin.oplog_list': {'user': 'joined'},
+    }
     reason = Column(String(512))
 
     def __init__(self, reason, *args, **kwargs):
@@ -221,25 +539,36 @@ class OpLog(BaseLog):
         self.reason = reason
 
 
-class Tag(Base):
+class Tag(Tombstone, Base):
     __tablename__ = 'tags'
+    __table_args__ = (
+        UniqueConstraint('name', 'tombstone', name='uq_tags_name'),
+    )
+    __unique_messages__ = {'uq_tags_name': '标签已存在'}
     name = Column(String(50), nullable=False)
     movie = relationship('Movie', backref='tag')
 
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
         if record_log:
-            op_log = OpLog(f'{OperatorEnum.operator_str(operator)}标签{self.name}')
-            db.session.add(op_log)
+            OpLog.record(reason=f'{OperatorEnum.operator_str(operator)}标签{self.name}', on_commit=True)
 
-    def _can_operator(self, form, operator=OperatorEnum.ADD):
-        if self.__class__.query.filter_by(name=form.name.data).first():
-            flash('标签已存在', 'error')
-            return False
-        return True
+    def _after_commit(self, operator=OperatorEnum.ADD):
+        reference_cache.invalidate('tags')
+        index_cache.invalidate()
+        if operator != OperatorEnum.ADD:
+            # 标签名是影片搜索文档的一部分
+            movie_search.invalidate()
 
 
-class Movie(Base):
+class Movie(Tombstone, Base):
     __tablename__ = 'movies'
+    __table_args__ = (
+        # 首页按标签、星级筛选后按时间keyset分页
+        Index('ix_movies_status_tag_id_star', 'status', 'tag_id', 'star', 'create_time'),
+        Index('ix_movies_status_create_time', 'status', 'create_time'),
+        UniqueConstraint('title', 'tombstone', name='uq_movies_title'),
+    )
+    __unique_messages__ = {'uq_movies_title': '影片已存在'}
     title = Column(String(255), nullable=False)
     url = Column(String(255))
     play_num = Column(BigInteger, default=0)
@@ -253,14 +582,40 @@ class Movie(Base):
     tag_id = Column(Integer, ForeignKey('tags.id'))
     comment = relationship('Comment', backref='movie')
     movie_col = relationship('MovieCol', backref='movie')
+    __load_profiles__ = {
+        'admin.movie_list': {'tag': 'joined'},
+    }
 
     def __repr__(self):
         return f'{self.__class__} {self.title!r}'
 
+    # 持久化的值加上尚未写回的增量
+    @property
+    def play_count(self):
+        return movie_counter.value(self, 'play_num')
+
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
         if record_log:
-            op_log = OpLog(f'{OperatorEnum.operator_str(operator)}影片{self.title}')
-            db.session.add(op_log)
+            OpLog.record(reason=f'{OperatorEnum.operator_str(operator)}影片{self.title}', on_commit=True)
+
+    @classmethod
+    def incr_comment_num(cls, movie_id, n=1):
+        # 在当前事务中原子更新: UPDATE movies SET comment_num = comment_num + n
+        table = cls.__table__
+        db.session.execute(table.update().where(table.c.id == movie_id).values(
+            comment_num=func.coalesce(table.c.comment_num, 0) + n))
+
+    @classmethod
+    def reconcile_comment_num(cls):
+        # 一条UPDATE在数据库中按有效评论数修正不一致的行(包括NULL)，返回修正的行数
+        table = cls.__table__
+        comments = Comment.__table__
+        count = select([func.count()]).where(
+            and_(comments.c.movie_id == table.c.id, comments.c.status == True)).as_scalar()
+        result = db.session.execute(table.update().where(
+            func.coalesce(table.c.comment_num, -1) != count).values(comment_num=count))
+        db.session.commit()
+        return result.rowcount
 
     def _handle_media_field(self, form, add=True):
         if form.url.data != '':
@@ -270,20 +625,37 @@ class Movie(Base):
 
         return super()._handle_media_field(form=form, add=add) + ['url', 'logo']
 
-    def _can_operator(self, form, operator=OperatorEnum.ADD):
-        if operator == OperatorEnum.UPDATE:
-            if (self.title != form.title.data) and self.__class__.query.filter_by(title=form.title.data).first():
-                flash('影片已存在', 'error')
-                return False
+    def _after_commit(self, operator=OperatorEnum.ADD):
+        index_cache.invalidate()
+        if operator == OperatorEnum.DELETE:
+            movie_search.remove(self)
         else:
-            if self.__class__.query.filter_by(title=form.title.data).first():
-                flash('影片已存在', 'error')
-                return False
-        return True
+            movie_search.add(self)
+
+    def search_document(self):
+        return {
+            'title': self.title,
+            'intro': self.intro,
+            'area': self.area,
+            'tag': self.tag.name if self.tag else '',
+        }
+
 
+movie_counter = BufferedCounter(db, Movie, ('play_num',))
+movie_search = Search(
+    Movie, Movie.search_document,
+    weights={'title': 4, 'tag': 2, 'area': 2, 'intro': 1},
+    like_columns=(Movie.title,),
+    load_options=('tag',),
+)
 
-class Preview(Base):
+
+class Preview(Tombstone, Base):
     __tablename__ = 'previews'
+    __table_args__ = (
+        UniqueConstraint('title', 'tombstone', name='uq_previews_title'),
+    )
+    __unique_messages__ = {'uq_previews_title': '预告已存在'}
     title = Column(String(255), nullable=False)
     logo = Column(String(255))
 
@@ -292,8 +664,7 @@ class Preview(Base):
 
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
         if record_log:
-            op_log = OpLog(f'{OperatorEnum.operator_str(operator)}预告{self.title}')
-            db.session.add(op_log)
+            OpLog.record(reason=f'{OperatorEnum.operator_str(operator)}预告{self.title}', on_commit=True)
 
     def _handle_media_field(self, form, add=True):
         if form.logo.data != '':
@@ -301,49 +672,75 @@ class Preview(Base):
 
         return super()._handle_media_field(form=form, add=add) + ['logo']
 
-    def _can_operator(self, form, operator=OperatorEnum.ADD):
-        if operator == OperatorEnum.UPDATE:
-            if (self.title != form.title.data) and self.__class__.query.filter_by(title=form.title.data).first():
-                flash('预告已存在', 'error')
-                return False
-        else:
-            if self.__class__.query.filter_by(title=form.title.data).first():
-                flash('预告已存在', 'error')
-                return False
-        return True
+    def _after_commit(self, operator=OperatorEnum.ADD):
+        reference_cache.invalidate('previews')
 
 
 class Comment(Base):
     __tablename__ = 'comments'
+    __table_args__ = (
+        Index('ix_comments_movie_id_status', 'movie_id', 'status'),
+        Index('ix_comments_user_id_status', 'user_id', 'status', 'create_time'),
+    )
     content = Column(Text)
     user_id = Column(Integer, ForeignKey('users.id'))
     movie_id = Column(Integer, ForeignKey('movies.id'))
+    __load_profiles__ = {
+        'home.play': {'user': 'joined'},
+        'home.comment_list': {'user': 'joined'},
+    }
 
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
         pass
 
+    def _before_commit(self, operator=OperatorEnum.ADD):
+        if operator == OperatorEnum.ADD:
+            Movie.incr_comment_num(self.movie_id)
+        elif operator == OperatorEnum.DELETE:
+            Movie.incr_comment_num(self.movie_id, -1)
+
     def __repr__(self):
         return f'{self.__class__} {self.id!r}'
 
 
-class MovieCol(Base):
+class MovieCol(Tombstone, Base):
     __tablename__ = 'movie_cols'
+    __table_args__ = (
+        Index('ix_movie_cols_user_id_movie_id_status', 'user_id', 'movie_id', 'status'),
+        UniqueConstraint('user_id', 'movie_id', 'tombstone', name='uq_movie_cols_user_id_movie_id'),
+    )
+    __unique_messages__ = {'uq_movie_cols_user_id_movie_id': '影片已收藏'}
     movie_id = Column(Integer, ForeignKey('movies.id'))
     user_id = Column(Integer, ForeignKey('users.id'))
+    __load_profiles__ = {
+        'home.movie_col_list': {'movie': 'joined'},
+    }
 
     def _log(self, operator=OperatorEnum.ADD, record_log=True):
         pass
 
-    def _can_operator(self, form, operator=OperatorEnum.ADD):
-        if self.__class__.query.filter_by(movie_id=self.movie_id, user_id=self.user_id).first():
-            flash('影片已收藏', 'error')
-            return False
-        return True
-
     def __repr__(self):
         return f'{self.__class__} {self.id!r}'
 
 
+media_store.register('AVATAR_PATH', User.avatar)
+media_store.register('MOVIE_PATH', Movie.url, Movie.logo)
+media_store.register('PREVIEW_PATH', Preview.logo)
+media_store.on_remove(thumbnailer.discard)
+
+
+# 缓存只保存查询出的元组，不持有与session绑定的ORM对象
+@reference_cache.loader('tags')
+def load_tags():
+    return Tag.query.filter_by().with_entities(Tag.id, Tag.name).order_by(Tag.id).all()
+
+
+@reference_cache.loader('previews')
+def load_previews():
+    return Preview.query.filter_by().with_entities(Preview.id, Preview.title, Preview.logo).order_by(Preview.id).all()
+
+
 @login_manager.user_loader
 def get_user(uid):
-    return User.query.get(int(uid))
+    # 优先使用session中的快照，快照失效时才查询users表
+    return identity_cache.load(uid, lambda ident: User.query.get(ident))
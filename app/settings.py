@@ -1,6 +1,36 @@
 import os
+import tempfile
 
 PER_PAGE = 10
+# 应用前面的反向代理(nginx等)层数，限流、登录日志、/metrics按X-Forwarded-For中的客户端地址判断；
+# 直接对外时保持0，否则客户端可以伪造X-Forwarded-For
+PROXY_COUNT = 0
+
+# 数据库连接池，SQLite文件库同样使用连接池；POOL_SIZE为0时改用NullPool，每次新建连接、用完即关闭(不是不限大小的连接池)
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_POOL_SIZE = 10
+SQLALCHEMY_MAX_OVERFLOW = 20
+SQLALCHEMY_POOL_TIMEOUT = 10
+SQLALCHEMY_POOL_RECYCLE = 3600
+# 取连接前先ping，避免使用被MySQL wait_timeout断开的连接
+SQLALCHEMY_POOL_PRE_PING = True
+# 只读副本的连接地址，为空时所有查询都使用主库；写入后STICKY秒内该用户的查询仍读主库
+SQLALCHEMY_REPLICAS = []
+SQLALCHEMY_REPLICA_STICKY = 5
+# 单个请求取连接累计等待超过该秒数时记录警告
+DB_SLOW_CHECKOUT = 0.1
+# 请求统计: 每个endpoint保留的样本数；超过SLOW_REQUEST秒的请求记录其SQL(最多SLOW_QUERIES条)
+METRICS_SAMPLES = 1000
+METRICS_SLOW_REQUEST = 1.0
+METRICS_SLOW_QUERIES = 50
+# /metrics的访问控制: TOKEN要求请求头Authorization: Bearer <TOKEN>(Prometheus的bearer_token)，ALLOW限制客户端地址
+# (在代理之后需设置PROXY_COUNT，否则所有请求的地址都是代理的地址)；两者都为空时禁止访问，后台的请求统计页面不受影响
+METRICS_TOKEN = None
+METRICS_ALLOW = ()
+# 是否给登录的管理员返回Server-Timing响应头(本次请求的SQL条数、SQL和模板渲染耗时)，普通用户和匿名访问始终不返回
+METRICS_SERVER_TIMING = False
+# keyset分页是否显示(估算的)总条数
+PAGINATION_APPROXIMATE_COUNT = False
 UP_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static', 'uploads')
 MOVIE_DIR = 'movie'
 PREVIEW_DIR = 'preview'
@@ -8,4 +38,77 @@ AVATAR_DIR = 'avatar'
 MOVIE_PATH = os.path.join(UP_DIR, MOVIE_DIR)
 PREVIEW_PATH = os.path.join(UP_DIR, PREVIEW_DIR)
 AVATAR_PATH = os.path.join(UP_DIR, AVATAR_DIR)
+# 上传文件的暂存目录，需与上面的目录在同一文件系统，保存时直接重命名
+UPLOAD_STAGING_PATH = os.path.join(UP_DIR, '.staging')
+# 超过该大小的上传直接流式写入暂存目录
+UPLOAD_STREAM_THRESHOLD = 1024 * 500
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 暂存目录中超过该秒数没有写入的分片上传会话和暂存文件，在创建新会话或执行media_gc时删除
+UPLOAD_STAGING_EXPIRE = 3600 * 24
+# 图片缩略图: 按目录配置尺寸名 -> (宽, 高)，高为None时等比缩放；需要安装Pillow
+THUMBNAIL_DIR = 'thumbs'
+THUMBNAIL_PATH = os.path.join(UP_DIR, THUMBNAIL_DIR)
+THUMBNAIL_SIZES = {
+    MOVIE_DIR: {'poster': (400, 500), 'list': (131, 83)},
+    PREVIEW_DIR: {'list': (120, None)},
+    AVATAR_DIR: {'avatar': (50, 50)},
+}
+THUMBNAIL_WORKERS = 2
+# 被替换/删除的媒体文件在提交后由后台线程删除
+MEDIA_WORKERS = 2
+# 进程内定时清理无人引用的文件，每次都会遍历整个上传目录；默认关闭，用cron定时执行manage.py media_gc，
+# 或只在一个指定的进程中设置INTERVAL
+MEDIA_SWEEP_INTERVAL = 0
+MEDIA_SWEEP_GRACE = 3600
+# 保存时会刷新已有文件的修改时间，RELEASE_GRACE秒内保存过的文件可能属于尚未提交的记录，到期后再检查引用并删除
+MEDIA_RELEASE_GRACE = 60
+
+# 视频播放: VIDEO_OFFLOAD为None时由应用直接发送，'x-accel'交给nginx的internal location(VIDEO_ACCEL_PREFIX)，
+# 'x-sendfile'交给apache/lighttpd；部署在代理之后时同时设置PROXY_COUNT
+VIDEO_OFFLOAD = None
+VIDEO_ACCEL_PREFIX = '/protected/movie/'
+VIDEO_CACHE_TIMEOUT = 3600 * 24
+
+# 播放/评论计数缓冲: 累计增量达到阈值或每隔INTERVAL秒由后台线程批量写回，INTERVAL为0时只按阈值写回
+COUNTER_FLUSH_THRESHOLD = 100
+COUNTER_FLUSH_INTERVAL = 5
+
+# 影片搜索后端: 'index'(进程内倒排索引) 或 'like'(数据库ILIKE)
+SEARCH_BACKEND = 'index'
+
+# 其他进程修改影片后，本进程的倒排索引在后台重建，等待该秒数合并连续的修改
+SEARCH_REBUILD_DELAY = 1
+
+# 标签、预告等参考数据缓存的共享版本号文件，同一台机器上的worker进程需指向同一路径
+REFERENCE_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'movie_reference_cache.db')
+# 密码哈希: 方法可写成'pbkdf2:sha256:<迭代次数>'调整强度，参数变化后用户下次登录时自动按新参数重新哈希
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+PASSWORD_SALT_LENGTH = 8
+# 密码校验线程池，同时超过WORKERS + QUEUE个校验时直接提示繁忙
+PASSWORD_WORKERS = 2
+PASSWORD_QUEUE = 32
+# 限流: 动作 -> [(维度, 次数, 窗口秒数)]，滑动窗口内超过次数时直接拒绝
+# BACKEND为'memory'时每个进程单独计数，'sqlite'时同一台机器上的worker进程通过RATELIMIT_PATH共享计数
+RATELIMIT_ENABLED = True
+RATELIMIT_BACKEND = 'memory'
+RATELIMIT_PATH = os.path.join(tempfile.gettempdir(), 'movie_ratelimit.db')
+RATELIMIT_RULES = {
+    'login': [('ip', 20, 60), ('email', 5, 300)],
+    'register': [('ip', 5, 3600)],
+    'movie_col_add': [('user', 30, 60), ('ip', 60, 60)],
+}
+# 登录用户的快照保存在session中，资料未变更时不再每个请求查询users表
+IDENTITY_CACHE = True
+# 首页匿名访问的页面缓存，PAGE_CACHE_SIZE为0时关闭
+PAGE_CACHE_SIZE = 256
+PAGE_CACHE_TTL = 60
+
+# 操作/登录日志写入: 'async'后台批量写入，'sync'同步写入(测试用)
+AUDIT_MODE = 'async'
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 1
+# 队列满时的处理: 'block'等待AUDIT_BLOCK_TIMEOUT秒后丢弃，'drop'直接丢弃，'sync'同步写入
+AUDIT_FULL_POLICY = 'block'
+AUDIT_BLOCK_TIMEOUT = 0.1
 
@@ -0,0 +1,249 @@
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app.models import db, User, Tag, Movie, Preview, Comment, MovieCol, UserLog, AdminLog, OpLog, \
+    movie_search, reference_cache, index_cache, password_hasher, rate_limiter
+from app.libs.enums import AuthEnum, RoleEnum
+from app.libs.permissions import PermissionMatrix, roles_required
+from app.libs.metrics import quantile
+from app.libs.bulk import batches
+from fake import title_lst, gen_date
+
+BATCH_SIZE = 5000
+PASSWORD = '123asd'
+ADMIN_EMAIL = 'admin@bench.com'
+
+_local = threading.local()
+
+
+def _insert(model, rows):
+    # Core executemany，每批提交一次
+    count = 0
+    for batch in batches(rows, BATCH_SIZE):
+        db.session.execute(model.__table__.insert(), batch)
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+def _times(num, now):
+    # 按id递增的创建时间，分布在过去num分钟内
+    for i in range(1, num + 1):
+        yield now - timedelta(minutes=num - i)
+
+
+def _users(num, password, now):
+    yield dict(name='bench_admin', email=ADMIN_EMAIL, phone='10000000000', confirm=True, intro='bench admin',
+               avatar='bench.jpg', auth=AuthEnum.SuperAdmin, role=RoleEnum.SuperAdmin, password=password,
+               create_time=now)
+    for i, create_time in enumerate(_times(num, now), 1):
+        yield dict(name=f'bench{i}', email=f'bench{i}@bench.com', phone=f'13{i:09d}', confirm=True,
+                   intro='normal user', avatar='bench.jpg', auth=AuthEnum.User, role=RoleEnum.User,
+                   password=password, create_time=create_time)
+
+
+def _movies(num, tag_ids, now):
+    stars = [star for star in range(1, 6) for _ in range(star)]
+    for i, create_time in enumerate(_times(num, now), 1):
+        title, tag_name, area = random.choice(title_lst)
+        yield dict(title=f'{title}-{i}', url='bench.mp4', logo='bench.jpg', intro=f'{title}-{i}', area=area,
+                   star=random.choice(stars), length=str(random.randint(90, 150)), tag_id=tag_ids[tag_name],
+                   publish_time=datetime.strptime(gen_date(), '%Y-%m-%d').date(),
+                   play_num=random.randint(0, 10000), comment_num=0, create_time=create_time)
+
+
+def _comments(num, movies, users, now):
+    for create_time in _times(num, now):
+        yield dict(content='bench comment', movie_id=random.randint(1, movies), user_id=random.randint(2, users + 1),
+                   create_time=create_time)
+
+
+def _movie_cols(num, movies, users, now):
+    seen = set()
+    num = min(num, movies * users)
+    while len(seen) < num:
+        seen.add((random.randint(2, users + 1), random.randint(1, movies)))
+    for (user_id, movie_id), create_time in zip(seen, _times(num, now)):
+        yield dict(user_id=user_id, movie_id=movie_id, create_time=create_time)
+
+
+def _logs(num, users, now, **values):
+    for create_time in _times(num, now):
+        yield dict(values, user_id=values.get('user_id') or random.randint(2, users + 1),
+                   ip=f'10.0.{random.randint(0, 255)}.{random.randint(1, 254)}', create_time=create_time)
+
+
+def bench_data(movies=10000, comments=0, users=0, logs=0, seed=0, reset=False):
+    # 生成基准测试数据，comments/users/logs为0时按影片数估算；数据库非空时需要--reset
+    if reset:
+        db.drop_all()
+        db.create_all()
+    elif Movie.query.with_deleted().first() is not None:
+        print('database is not empty, use --reset to regenerate')
+        return
+    random.seed(seed)
+    comments = comments or movies * 2
+    users = users or max(movies // 20, 100)
+    logs = logs or movies
+    now = datetime.now()
+    # 所有用户共用同一个密码哈希
+    password = password_hasher.hash(PASSWORD)
+    tag_names = sorted({tag_name for _, tag_name, _ in title_lst})
+
+    start = time.perf_counter()
+    counts = [
+        ('users', _insert(User, _users(users, password, now))),
+        ('tags', _insert(Tag, (dict(name=name, create_time=now) for name in tag_names))),
+    ]
+    tag_ids = dict(db.session.query(Tag.name, Tag.id))
+    counts += [
+        ('movies', _insert(Movie, _movies(movies, tag_ids, now))),
+        ('previews', _insert(Preview, (dict(title=f'{title_lst[i % len(title_lst)][0]}-{i}', logo='bench.jpg',
+                                            create_time=now) for i in range(1, 21)))),
+        ('comments', _insert(Comment, _comments(comments, movies, users, now))),
+        ('movie_cols', _insert(MovieCol, _movie_cols(movies, movies, users, now))),
+        ('user_logs', _insert(UserLog, _logs(logs, users, now))),
+        ('admin_logs', _insert(AdminLog, _logs(logs // 10, users, now, user_id=1))),
+        ('op_logs', _insert(OpLog, _logs(logs // 10, users, now, user_id=1, reason='添加影片'))),
+    ]
+    Movie.reconcile_comment_num()
+    cost = time.perf_counter() - start
+    total = sum(count for _, count in counts)
+    print(', '.join(f'{name}={count}' for name, count in counts))
+    print(f'{total} rows in {cost:.1f}s, {total / cost:.0f} rows/s')
+
+    # 绕过了模型钩子，需要手动使所有进程的缓存和索引失效
+    reference_cache.invalidate('tags')
+    reference_cache.invalidate('previews')
+    index_cache.invalidate()
+    movie_search.invalidate()
+
+
+def _scenarios(movies, users, tags, logs):
+    per_page = current_app.config['PER_PAGE']
+
+    def page(total=movies, limit=100):
+        return random.randint(1, max(min((total + per_page - 1) // per_page, limit), 1))
+
+    def user_login():
+        return {'email': f'bench{random.randint(1, users)}@bench.com', 'password': PASSWORD}
+
+    # (名称, 客户端, 方法, 生成url, 生成表单)
+    return (
+        ('home.index (anon)', 'anon', 'get', lambda: f'/{page()}/', None),
+        ('home.index', 'user', 'get', lambda: f'/{page()}/', None),
+        ('home.index?tid&star', 'user', 'get',
+         lambda: f'/{page(limit=10)}/?tid={random.randint(1, tags)}&star={random.randint(1, 5)}', None),
+        ('home.index?play_num', 'user', 'get', lambda: f'/{page(limit=10)}/?play_num=1', None),
+        ('home.search', 'user', 'get', lambda: f'/search/{page(limit=5)}?key={random.choice(title_lst)[0]}', None),
+        ('home.play', 'user', 'get', lambda: f'/play/{random.randint(1, movies)}/1/', None),
+        ('auth.login', 'anon', 'post', lambda: '/login/', user_login),
+        ('admin.movie_list', 'admin', 'get', lambda: f'/admin/movie/list/{page()}/', None),
+        ('admin.user_login_log_list', 'admin', 'get', lambda: f'/admin/user_login_log/list/{page(logs)}/', None),
+        ('auth.user_list', 'admin', 'get', lambda: f'/admin/user/list/{page(users)}', None),
+    )
+
+
+def _client(app, kind, users):
+    # 每个线程每种身份一个已登录的客户端
+    clients = _local.__dict__.setdefault('clients', {})
+    if kind not in clients:
+        client = app.test_client()
+        if kind == 'user':
+            client.post('/login/', data={'email': f'bench{random.randint(1, users)}@bench.com', 'password': PASSWORD})
+        elif kind == 'admin':
+            client.post('/login/', data={'email': ADMIN_EMAIL, 'password': PASSWORD})
+        clients[kind] = client
+    return clients[kind]
+
+
+def _request(app, scenario, users):
+    name, kind, method, make_url, make_data = scenario
+    client = _client(app, kind, users)
+    url = make_url()
+    data = make_data() if make_data else None
+    start = time.perf_counter()
+    response = getattr(client, method)(url, data=data)
+    cost = time.perf_counter() - start
+    response.close()
+    return cost, response.status_code < 400
+
+
+def bench(requests=200, workers=1, only=''):
+    # 通过test client对主要页面压测，输出吞吐量和p50/p99延迟；only按名称前缀过滤场景
+    app = current_app._get_current_object()
+    app.config['WTF_CSRF_ENABLED'] = False
+    # 所有请求来自同一个地址，压测时关闭限流
+    rate_limiter.enabled = False
+    movies = Movie.query.count()
+    users = User.query.filter(User.auth == AuthEnum.User).count()
+    tags = Tag.query.count()
+    logs = UserLog.query.count()
+    if (not movies) or (not users):
+        print('no data, run bench_data first')
+        return
+    print(f'{movies} movies, {users} users, {requests} requests x {workers} workers')
+    print(f'{"scenario":<28}{"reqs":>6}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}')
+    for scenario in _scenarios(movies, users, tags, logs):
+        if not scenario[0].startswith(only):
+            continue
+        # 每个线程在自己的应用上下文中发请求，与当前命令的上下文隔离
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda _: _request(app, scenario, users), range(workers)))
+            start = time.perf_counter()
+            results = list(executor.map(lambda _: _request(app, scenario, users), range(requests)))
+            cost = time.perf_counter() - start
+        costs = [result[0] for result in results]
+        errors = sum(1 for result in results if not result[1])
+        print(f'{scenario[0]:<28}{requests:>6}{errors:>8}{requests / cost:>9.1f}'
+              f'{quantile(costs, 0.5) * 1000:>9.1f}{quantile(costs, 0.99) * 1000:>9.1f}')
+
+
+def _legacy_required(roles):
+    # 原来的写法: 每个装饰器在每次调用时构造列表再判断 role in [...]
+    def decorator(f):
+        def wrapper(role):
+            if role in [getattr(RoleEnum, name) for name in roles]:
+                return f(role)
+            return False
+
+        return wrapper
+
+    return decorator
+
+
+def bench_permissions(endpoints=1000, checks=200000, seed=0):
+    # 对比装饰器链与编译后的位图: 随机生成endpoints个视图，每个视图叠加1~3个角色装饰器
+    random.seed(seed)
+    roles = list(RoleEnum)
+    legacy_views, marked_views = {}, {}
+    for i in range(endpoints):
+        legacy_view = marked_view = lambda role: True
+        for _ in range(random.randint(1, 3)):
+            allowed = random.sample(roles, random.randint(1, len(roles)))
+            legacy_view = _legacy_required([role.name for role in allowed])(legacy_view)
+            marked_view = roles_required(*allowed)(marked_view)
+        legacy_views[f'endpoint{i}'] = legacy_view
+        marked_views[f'endpoint{i}'] = marked_view
+
+    start = time.perf_counter()
+    matrix = PermissionMatrix()
+    matrix.compile(marked_views)
+    compile_cost = time.perf_counter() - start
+    samples = [(f'endpoint{random.randrange(endpoints)}', random.choice(roles)) for _ in range(checks)]
+
+    start = time.perf_counter()
+    legacy_allowed = sum(1 for endpoint, role in samples if legacy_views[endpoint](role))
+    legacy_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    matrix_allowed = sum(1 for endpoint, role in samples if matrix.allowed(endpoint, role))
+    matrix_cost = time.perf_counter() - start
+
+    print(f'{endpoints} endpoints, {len(roles)} roles, compiled in {compile_cost * 1000:.1f}ms')
+    print(f'decorators: {legacy_cost / checks * 1e9:.0f}ns/check, {legacy_allowed} allowed')
+    print(f'    matrix: {matrix_cost / checks * 1e9:.0f}ns/check, {matrix_allowed} allowed')
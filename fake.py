@@ -60,6 +60,7 @@ class Create:
             make_dirs(app.config['MOVIE_PATH'], permission=permission)
             make_dirs(app.config['PREVIEW_PATH'], permission=permission)
             make_dirs(app.config['AVATAR_PATH'], permission=permission)
+            make_dirs(app.config['UPLOAD_STAGING_PATH'], permission=permission)
 
     def __call__(self, *args, **kwargs):
         func_lst = []
@@ -1,10 +1,90 @@
 import stat
+import time
 
+from flask import current_app
 from flask_migrate import MigrateCommand
 from flask_script import Manager, Server
 
 from app import create_app
 from app.libs.utils import make_dirs
+from app.libs.bulk import BulkLoader, Rows, read_rows
+from app.libs.upload import ChunkedUpload
+from app.models import db, movie_search, media_store, reference_cache, index_cache, password_hasher, User, Tag, \
+    Movie, Preview, Comment, LIST_QUERIES
+from bench import bench_data, bench, bench_permissions
+
+
+def search_bench(key='星球', rounds=20):
+    # 对比倒排索引与ILIKE两种搜索后端在当前数据库上的耗时
+    per_page = current_app.config['PER_PAGE']
+    start = time.perf_counter()
+    size = movie_search.rebuild()
+    print(f'build index: {size} movies in {time.perf_counter() - start:.2f}s')
+    for backend in ('like', 'index'):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            page_data = movie_search.search(key, page=1, per_page=per_page, backend=backend)
+        cost = (time.perf_counter() - start) / rounds * 1000
+        print(f'{backend:>5}: {page_data.total} hits, {cost:.2f}ms/query')
+
+
+def media_gc(grace=3600, dry_run=False):
+    # 清理没有被User.avatar、Movie.url/logo、Preview.logo引用的媒体文件，可由cron定时执行
+    removed, size = media_store.collect(grace=grace, dry_run=dry_run)
+    print(f'{"would remove" if dry_run else "removed"} {removed} files, {size / 1024 / 1024:.1f}MB')
+    if not dry_run:
+        expired = ChunkedUpload.expire(current_app.config['UPLOAD_STAGING_PATH'],
+                                       current_app.config['UPLOAD_STAGING_EXPIRE'])
+        print(f'removed {expired} expired staging files')
+
+
+def reconcile_comments():
+    # 按comments表重新统计movies.comment_num
+    print(f'fixed comment_num of {Movie.reconcile_comment_num()} movies')
+
+
+def explain_queries():
+    # 对视图中注册的列表查询执行EXPLAIN，标出全表扫描
+    full_scans = 0
+    for name, make_query in LIST_QUERIES.items():
+        print(name)
+        for table, full, detail in make_query().explain():
+            full_scans += full
+            print(f'  {"FULL SCAN" if full else "ok":<9} {table or "-":<12} {detail}')
+    print(f'{full_scans} full scans in {len(LIST_QUERIES)} queries')
+
+
+# 可导入的数据: 表 -> (模型, 需要复制的媒体列及保存目录的配置项)
+BULK_IMPORTS = {
+    'users': (User, (('avatar', 'AVATAR_PATH'),)),
+    'tags': (Tag, ()),
+    'movies': (Movie, (('url', 'MOVIE_PATH'), ('logo', 'MOVIE_PATH'))),
+    'previews': (Preview, (('logo', 'PREVIEW_PATH'),)),
+    'comments': (Comment, ()),
+}
+
+
+def bulk_import(kind, path, media_dir='', password='', batch_size=500, workers=4, defer_indexes=False):
+    # 从csv/jsonl批量导入users/tags/movies/previews/comments
+    # media_dir: 媒体列中文件名所在的目录，为空时媒体列原样写入；password: 没有password/password_hash列时使用的密码
+    model, media = BULK_IMPORTS[kind]
+    loader = BulkLoader(db, media_store, batch_size=batch_size, workers=workers, media_dir=media_dir or None,
+                        defer_indexes=defer_indexes)
+    rows = Rows(password=password or None, tag_ids=dict(db.session.query(Tag.name, Tag.id)),
+                hash_password=password_hasher.hash)
+    count, cost = loader.load(model, map(getattr(rows, kind), read_rows(path)),
+                              media=[(column, current_app.config[key]) for column, key in media])
+    print(f'{kind}: {count} rows in {cost:.1f}s, {count / cost if cost else 0:.0f} rows/s')
+
+    # 绕过了模型钩子，需要手动维护冗余计数、缓存和索引
+    if kind == 'comments':
+        Movie.reconcile_comment_num()
+    elif kind == 'movies':
+        index_cache.invalidate()
+        movie_search.invalidate()
+    elif kind in ('tags', 'previews'):
+        reference_cache.invalidate(kind)
+        index_cache.invalidate()
 
 
 def main():
@@ -14,8 +94,17 @@ def main():
     make_dirs(app.config['MOVIE_PATH'], permission=permission)
     make_dirs(app.config['PREVIEW_PATH'], permission=permission)
     make_dirs(app.config['AVATAR_PATH'], permission=permission)
+    make_dirs(app.config['UPLOAD_STAGING_PATH'], permission=permission)
     manager = Manager(app)
     manager.add_command('db', MigrateCommand)
+    manager.command(search_bench)
+    manager.command(media_gc)
+    manager.command(reconcile_comments)
+    manager.command(explain_queries)
+    manager.command(bench_data)
+    manager.command(bench)
+    manager.command(bench_permissions)
+    manager.command(bulk_import)
     manager.add_command('runserver ', Server(host='localhost', port=5000, use_debugger=False))
     manager.run()
 
@@ -0,0 +1,46 @@
+"""add composite indexes for list queries
+
+Revision ID: 3f2a9c1d7b64
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b64'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_users_email_status', 'users', ['email', 'status']),
+    ('ix_users_auth_status', 'users', ['auth', 'status']),
+    ('ix_movies_status_tag_id_star', 'movies', ['status', 'tag_id', 'star', 'create_time']),
+    ('ix_movies_status_create_time', 'movies', ['status', 'create_time']),
+    ('ix_comments_movie_id_status', 'comments', ['movie_id', 'status']),
+    ('ix_comments_user_id_status', 'comments', ['user_id', 'status', 'create_time']),
+    ('ix_movie_cols_user_id_movie_id_status', 'movie_cols', ['user_id', 'movie_id', 'status']),
+    ('ix_user_logs_user_id', 'user_logs', ['user_id']),
+    ('ix_admin_logs_user_id', 'admin_logs', ['user_id']),
+    ('ix_op_logs_user_id', 'op_logs', ['user_id']),
+)
+
+
+def _existing(table):
+    # 表由db.create_all()创建，新库上索引可能已经存在
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        if name not in _existing(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        if name in _existing(table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,65 @@
+"""add unique constraints
+
+Revision ID: 8d41e6b0c2f5
+Revises: 3f2a9c1d7b64
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6b0c2f5'
+down_revision = '3f2a9c1d7b64'
+branch_labels = None
+depends_on = None
+
+# 升级前需要先清理未删除记录中的重复数据；唯一约束包含tombstone列，已软删除的记录不参与
+CONSTRAINTS = (
+    ('uq_users_email', 'users', ['email', 'tombstone']),
+    ('uq_users_name', 'users', ['name', 'tombstone']),
+    ('uq_users_phone', 'users', ['phone', 'tombstone']),
+    ('uq_tags_name', 'tags', ['name', 'tombstone']),
+    ('uq_movies_title', 'movies', ['title', 'tombstone']),
+    ('uq_previews_title', 'previews', ['title', 'tombstone']),
+    ('uq_movie_cols_user_id_movie_id', 'movie_cols', ['user_id', 'movie_id', 'tombstone']),
+)
+TOMBSTONE_TABLES = ('users', 'tags', 'movies', 'previews', 'movie_cols')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _existing(table):
+    # 新库由db.create_all()建表，约束可能已经存在
+    constraints = sa.inspect(op.get_bind()).get_unique_constraints(table)
+    return _indexes(table) | {constraint['name'] for constraint in constraints}
+
+
+def upgrade():
+    # 正常记录为0，已软删除的记录设为自身id
+    for table in TOMBSTONE_TABLES:
+        if 'tombstone' not in _columns(table):
+            op.add_column(table, sa.Column('tombstone', sa.Integer(), nullable=False, server_default='0'))
+            op.execute(f'UPDATE {table} SET tombstone = id WHERE status = 0')
+    # 以唯一索引的形式创建，SQLite不支持ALTER TABLE ADD CONSTRAINT
+    for name, table, columns in CONSTRAINTS:
+        if name not in _existing(table):
+            op.create_index(name, table, columns, unique=True)
+
+
+def downgrade():
+    # 只删除以唯一索引形式创建的约束和本次添加的列
+    for name, table, columns in reversed(CONSTRAINTS):
+        if name in _indexes(table):
+            op.drop_index(name, table_name=table)
+    for table in reversed(TOMBSTONE_TABLES):
+        if 'tombstone' in _columns(table):
+            with op.batch_alter_table(table) as batch_op:
+                batch_op.drop_column('tombstone')
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+# 导入app之前指定测试用的SQLite数据库
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+
+from app import create_app
+from app.models import rate_limiter
+
+
+@pytest.fixture(scope='session')
+def app():
+    # 所有测试共用一个应用和数据库，各模块使用不同的用户名、邮箱
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    rate_limiter.enabled = False
+    return app
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from app.models import db, Movie, Comment
+from app.libs.counter import BufferedCounter
+
+
+def _movie(title, comment_num=0):
+    movie = Movie(title=title, star=3, play_num=0, comment_num=comment_num)
+    db.session.add(movie)
+    db.session.flush()
+    return movie
+
+
+def test_reconcile_comment_num_fixes_drift(app):
+    with app.app_context():
+        drifted, missing, correct = _movie('count_drift', 7), _movie('count_null'), _movie('count_ok', 1)
+        table = Movie.__table__
+        db.session.execute(table.update().where(table.c.id == missing.id).values(comment_num=None))
+        # 已删除的评论不计入
+        db.session.execute(Comment.__table__.insert(), [
+            {'content': 'c', 'movie_id': drifted.id, 'status': True},
+            {'content': 'c', 'movie_id': drifted.id, 'status': True},
+            {'content': 'c', 'movie_id': drifted.id, 'status': False},
+            {'content': 'c', 'movie_id': correct.id, 'status': True},
+        ])
+        db.session.commit()
+        ids = drifted.id, missing.id, correct.id
+
+        assert Movie.reconcile_comment_num() >= 2
+        assert Movie.reconcile_comment_num() == 0
+        counts = dict(db.session.query(Movie.id, Movie.comment_num).filter(Movie.id.in_(ids)))
+        assert [counts[ident] for ident in ids] == [2, 0, 1]
+
+
+@pytest.fixture
+def counter(app, monkeypatch):
+    def make(threshold, interval):
+        monkeypatch.setitem(app.config, 'COUNTER_FLUSH_THRESHOLD', threshold)
+        monkeypatch.setitem(app.config, 'COUNTER_FLUSH_INTERVAL', interval)
+        counters.append(BufferedCounter(db, Movie, ('play_num',)))
+        counters[-1].init_app(app)
+        return counters[-1]
+
+    counters = []
+    yield make
+    for c in counters:
+        c.stop()
+
+
+def _play_nums(app, ids, timeout=0):
+    # 等待后台线程写回，最多timeout秒
+    deadline = time.time() + timeout
+    while True:
+        with app.app_context():
+            nums = dict(db.session.query(Movie.id, Movie.play_num).filter(Movie.id.in_(ids)))
+        if (time.time() >= deadline) or all(nums.values()):
+            return [nums[ident] for ident in ids]
+        time.sleep(0.05)
+
+
+def test_threshold_flush(app, counter):
+    with app.app_context():
+        ident = _movie('count_threshold').id
+        db.session.commit()
+    c = counter(5, 0)
+    for _ in range(4):
+        c.incr(ident, 'play_num')
+    assert _play_nums(app, [ident], timeout=0.3) == [0]
+    assert c.pending(ident, 'play_num') == 4
+    # 读取时加上缓冲区中的增量
+    with app.app_context():
+        assert c.value(Movie.query.get(ident), 'play_num') == 4
+    c.incr(ident, 'play_num')
+    assert _play_nums(app, [ident], timeout=2) == [5]
+    assert c.pending(ident, 'play_num') == 0
+
+
+def test_interval_flush(app, counter):
+    with app.app_context():
+        ids = [_movie('count_interval_a').id, _movie('count_interval_b').id]
+        db.session.commit()
+    c = counter(1000, 0.1)
+    c.incr(ids[0], 'play_num', 2)
+    c.incr(ids[1], 'play_num', 3)
+    assert _play_nums(app, ids, timeout=2) == [2, 3]
+    c.incr(ids[0], 'play_num')
+    time.sleep(0.3)
+    assert _play_nums(app, ids) == [3, 3]
+
+
+def test_unknown_field_is_rejected(app, counter):
+    with pytest.raises(KeyError):
+        counter(5, 0).incr(1, 'comment_num')
@@ -0,0 +1,73 @@
+import pytest
+from flask_login import login_required
+
+from app.models import db, User
+from app.libs.enums import AuthEnum, RoleEnum
+from app.libs.permissions import PermissionMatrix, roles_required, tag_admin_required
+
+PASSWORD = '123asd'
+
+
+@pytest.fixture(scope='module')
+def login(app):
+    with app.app_context():
+        for name, role in (('perm_tag', RoleEnum.TagAdmin), ('perm_movie', RoleEnum.MovieAdmin)):
+            user = User(name=name, email=f'{name}@test.com', auth=AuthEnum.Admin, role=role, avatar='a.jpg')
+            user.password = PASSWORD
+            db.session.add(user)
+        db.session.commit()
+
+    def login(name):
+        client = app.test_client()
+        client.post('/login/', data={'email': f'{name}@test.com', 'password': PASSWORD})
+        return client
+
+    return login
+
+
+def test_anonymous_is_redirected_to_login(app):
+    response = app.test_client().get('/admin/tag/list/1')
+    assert response.status_code == 302
+    assert '/login/' in response.headers['Location']
+
+
+def test_role_is_checked(login):
+    client = login('perm_movie')
+    assert client.get('/admin/tag/list/1').status_code == 403
+    assert client.get('/admin/movie/list/1/').status_code == 200
+    assert login('perm_tag').get('/admin/tag/list/1').status_code == 200
+
+
+def test_stacked_decorators_intersect():
+    @roles_required(RoleEnum.TagAdmin, RoleEnum.MovieAdmin)
+    @roles_required(RoleEnum.MovieAdmin, RoleEnum.SuperAdmin)
+    def view():
+        pass
+
+    assert view.required_roles == {RoleEnum.MovieAdmin}
+    matrix = PermissionMatrix()
+    matrix.compile({'view': view})
+    assert matrix.allowed('view', RoleEnum.MovieAdmin)
+    assert not matrix.allowed('view', RoleEnum.TagAdmin)
+    assert not matrix.allowed('view', RoleEnum.SuperAdmin)
+
+
+def test_marks_survive_login_required():
+    @login_required
+    @tag_admin_required
+    def view():
+        pass
+
+    assert view.required_roles == {RoleEnum.TagAdmin, RoleEnum.SuperAdmin}
+
+
+def test_protected_blueprint_requires_marks():
+    matrix = PermissionMatrix(protected=('admin',))
+    with pytest.raises(RuntimeError, match='admin.open'):
+        matrix.compile({'admin.open': lambda: None, 'home.index': lambda: None})
+
+
+def test_views_added_after_init_app_are_checked(app, login):
+    app.add_url_rule('/admin/late/', 'admin.late', tag_admin_required(lambda: 'late'))
+    assert login('perm_movie').get('/admin/late/').status_code == 403
+    assert login('perm_tag').get('/admin/late/').status_code == 200
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from app.models import db, User, Tag, Movie, Comment, MovieCol, UserLog, AdminLog, OpLog
+from app.libs.enums import AuthEnum, RoleEnum
+
+PASSWORD = '123asd'
+
+# 列表页 -> 允许的最多查询数；数据行数增加后查询数不能变化
+ENDPOINTS = {
+    'admin.movie_list': ('admin', '/admin/movie/list/1/', 2),
+    'admin.oplog_list': ('admin', '/admin/oplog/list/1', 1),
+    'admin.user_login_log_list': ('admin', '/admin/user_login_log/list/1/', 1),
+    'admin.admin_login_log_list': ('admin', '/admin/admin_login_log/list/1/', 1),
+    'home.play': ('user', '/play/{movie_id}/1/', 4),
+    'home.movie_col_list': ('user', '/movie_col/list/1', 2),
+    'home.comment_list': ('user', '/comment/list/1', 1),
+}
+
+
+def _user(name, auth=AuthEnum.User, role=RoleEnum.User):
+    user = User(name=name, email=f'{name}@test.com', auth=auth, role=role, avatar='a.jpg')
+    user.password = PASSWORD
+    return user
+
+
+def _seed(n, start, shared=False):
+    # shared时所有行关联同一个用户、管理员和标签；否则每一行关联不同的对象，关系属性的N+1查询会随行数增加
+    count = 1 if shared else n
+    users = [_user(f'user{start + i}') for i in range(count)]
+    admins = [_user(f'admin{start + i}', AuthEnum.Admin, RoleEnum.Admin) for i in range(count)]
+    tags = [Tag(name=f'tag{start + i}') for i in range(count)]
+    db.session.add_all(users + admins + tags)
+    db.session.flush()
+    users, admins, tags = [[objs[i % count] for i in range(n)] for objs in (users, admins, tags)]
+    movies = [Movie(title=f'movie{start + i}', tag_id=tags[i].id, star=3, url='a.mp4', logo='a.jpg', play_num=0,
+                    comment_num=0) for i in range(n)]
+    db.session.add_all(movies)
+    db.session.flush()
+    owner = User.query.filter_by(email='user@test.com').one()
+    # 播放页的评论都属于第一次生成的第一部影片
+    play = Movie.query.filter_by(title='movie0').one()
+    for i in range(n):
+        db.session.add_all([
+            Comment(content='comment', movie_id=play.id, user_id=users[i].id),
+            Comment(content='comment', movie_id=movies[i].id, user_id=owner.id),
+            MovieCol(movie_id=movies[i].id, user_id=owner.id),
+        ])
+    # 日志模型的构造函数依赖请求上下文，直接插入
+    for model, values in ((UserLog, {}), (AdminLog, {}), (OpLog, {'reason': 'test'})):
+        owners = users if model is UserLog else admins
+        db.session.execute(model.__table__.insert(), [
+            dict(values, user_id=user.id, ip='127.0.0.1', status=True) for user in owners
+        ])
+    db.session.commit()
+
+
+@pytest.fixture(scope='module')
+def clients(app):
+    with app.app_context():
+        db.session.add_all([
+            _user('user'),
+            _user('admin', AuthEnum.SuperAdmin, RoleEnum.SuperAdmin),
+        ])
+        db.session.commit()
+    clients = {}
+    for kind in ('user', 'admin'):
+        client = app.test_client()
+        client.post('/login/', data={'email': f'{kind}@test.com', 'password': PASSWORD})
+        clients[kind] = client
+    return clients
+
+
+def _count_queries(app, client, url):
+    # 只统计当前线程的查询，后台写入日志、刷新计数的查询不计入
+    ident = threading.get_ident()
+    count = [0]
+
+    def before_cursor_execute(*args):
+        if threading.get_ident() == ident:
+            count[0] += 1
+
+    # 先请求一次，填充参考数据缓存和用户快照
+    client.get(url)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    return count[0]
+
+
+def test_list_queries_do_not_grow_with_rows(app, clients):
+    # 两次都超过一页，分页的COUNT查询始终存在；第二次新增的一页数据各自关联不同的对象
+    with app.app_context():
+        _seed(app.config['PER_PAGE'] + 1, 0, shared=True)
+        movie_id = Movie.query.filter_by(title='movie0').one().id
+    small = {name: _count_queries(app, clients[kind], url.format(movie_id=movie_id))
+             for name, (kind, url, _) in ENDPOINTS.items()}
+    with app.app_context():
+        _seed(app.config['PER_PAGE'], 100)
+    large = {name: _count_queries(app, clients[kind], url.format(movie_id=movie_id))
+             for name, (kind, url, _) in ENDPOINTS.items()}
+
+    for name, (_, _, limit) in ENDPOINTS.items():
+        assert large[name] == small[name], f'{name}: {small[name]} -> {large[name]} queries'
+        assert large[name] <= limit, f'{name}: {large[name]} queries'
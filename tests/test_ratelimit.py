@@ -0,0 +1,77 @@
+import pytest
+
+from app.models import db, User, Movie, MovieCol
+from app.libs.ratelimit import MemoryBackend, SQLiteBackend
+
+LIMIT = 10
+WINDOW = 60
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'ratelimit.db'))
+
+
+def _fill(backend, now, key='k'):
+    for _ in range(LIMIT):
+        assert backend.hit(key, LIMIT, WINDOW, now=now) == 0
+
+
+def _allowed(backend, now, key='k'):
+    # 连续请求直到被拒绝，返回放行的次数
+    allowed = 0
+    while backend.hit(key, LIMIT, WINDOW, now=now) == 0:
+        allowed += 1
+    return allowed
+
+
+def test_limit_within_window(backend):
+    _fill(backend, 10)
+    assert backend.hit('k', LIMIT, WINDOW, now=20) > 0
+    # 不同的key分别计数
+    assert backend.hit('other', LIMIT, WINDOW, now=20) == 0
+
+
+def test_previous_window_is_weighted(backend):
+    _fill(backend, 10)
+    # 下一个窗口过半时上一个窗口按一半计入
+    assert _allowed(backend, 90) == LIMIT // 2
+    # 上一个窗口没有请求时不再计入更早的窗口
+    assert _allowed(backend, 200) == LIMIT
+
+
+def test_retry_after_full_window(backend):
+    _fill(backend, 10)
+    wait = backend.hit('k', LIMIT, WINDOW, now=20)
+    # 到下一个窗口开始时上一个窗口的权重仍为1，需要再过一点时间
+    assert wait == 41
+    assert backend.hit('k', LIMIT, WINDOW, now=20 + wait - 1) > 0
+    assert backend.hit('k', LIMIT, WINDOW, now=20 + wait) == 0
+
+
+def test_retry_after_weighted_window(backend):
+    _fill(backend, 10)
+    assert _allowed(backend, 90) == LIMIT // 2
+    wait = backend.hit('k', LIMIT, WINDOW, now=90)
+    assert wait == 1
+    assert backend.hit('k', LIMIT, WINDOW, now=90 + wait) == 0
+
+
+def test_movie_col_add_uses_logged_in_user(app):
+    with app.app_context():
+        user = User(name='col_user', email='col_user@test.com', avatar='a.jpg')
+        user.password = '123asd'
+        movie = Movie(title='col_movie', star=3, url='a.mp4', logo='a.jpg', play_num=0, comment_num=0)
+        db.session.add_all([user, movie])
+        db.session.commit()
+        uid, mid = user.id, movie.id
+
+    client = app.test_client()
+    assert client.get(f'/movie_col/add?mid={mid}').status_code == 302
+    client.post('/login/', data={'email': 'col_user@test.com', 'password': '123asd'})
+    # 客户端传来的uid被忽略
+    assert client.get(f'/movie_col/add?uid={uid + 1000}&mid={mid}').status_code == 200
+    with app.app_context():
+        assert [col.user_id for col in MovieCol.query.filter_by(movie_id=mid)] == [uid]
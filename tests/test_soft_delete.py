@@ -0,0 +1,91 @@
+import pytest
+from flask import get_flashed_messages
+from werkzeug.exceptions import NotFound
+
+from app.models import db, Tag, Movie, User
+
+
+def _delete(app, model, ident):
+    # delete()会flash提示，需要请求上下文
+    with app.test_request_context():
+        model.query.get(ident).delete(record_log=False)
+
+
+@pytest.fixture
+def tag(app):
+    with app.app_context():
+        tag = Tag(name='soft_tag')
+        db.session.add(tag)
+        db.session.flush()
+        movies = [Movie(title=f'soft_movie{i}', tag_id=tag.id, star=3) for i in range(2)]
+        db.session.add_all(movies)
+        db.session.commit()
+        ids = tag.id, [movie.id for movie in movies]
+    _delete(app, Movie, ids[1][0])
+    yield ids
+    with app.app_context():
+        Movie.query.with_deleted().filter(Movie.id.in_(ids[1])).delete(synchronize_session=False)
+        Tag.query.with_deleted().filter_by(id=ids[0]).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def test_deleted_row_is_hidden(app, tag):
+    tag_id, (deleted, kept) = tag
+    with app.app_context():
+        assert [movie.id for movie in Movie.query.filter(Movie.id.in_([deleted, kept]))] == [kept]
+        assert Movie.query.get(deleted) is None
+        with pytest.raises(NotFound):
+            Movie.query.get_or_404(deleted)
+        # 关系的延迟加载同样过滤
+        assert [movie.id for movie in Tag.query.get(tag_id).movie] == [kept]
+
+
+def test_with_deleted_includes_deleted_row(app, tag):
+    tag_id, (deleted, kept) = tag
+    with app.app_context():
+        movies = Movie.query.with_deleted().filter(Movie.id.in_([deleted, kept])).order_by(Movie.id).all()
+        assert [(movie.id, movie.status) for movie in movies] == [(deleted, False), (kept, True)]
+
+
+def _add(app, obj):
+    # 返回add()的结果和flash的提示
+    with app.test_request_context():
+        ok = obj.add(record_log=False)
+        return ok, get_flashed_messages(with_categories=True)
+
+
+def _register(app, name, email, phone):
+    # 用户的add依赖注册表单，通过注册页面添加
+    client = app.test_client()
+    client.post('/register/', data={'name': name, 'email': email, 'phone': phone, 'password': '123asd',
+                                    'repassword': '123asd'})
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
+
+
+def test_deleted_values_can_be_added_again(app):
+    assert _add(app, Tag(name='tomb_tag'))[0]
+    with app.app_context():
+        first = Tag.query.filter_by(name='tomb_tag').one().id
+    _delete(app, Tag, first)
+    assert _add(app, Tag(name='tomb_tag')) == (True, [('message', '添加成功')])
+
+    assert _register(app, 'tomb_user', 'tomb@test.com', '13800000001') == [('message', '添加成功')]
+    with app.app_context():
+        user = User.query.filter_by(email='tomb@test.com').one().id
+    _delete(app, User, user)
+    assert _register(app, 'tomb_user', 'tomb@test.com', '13800000001') == [('message', '添加成功')]
+
+    with app.app_context():
+        tags = Tag.query.with_deleted().filter_by(name='tomb_tag').order_by(Tag.id).all()
+        assert [(tag.status, tag.tombstone) for tag in tags] == [(False, first), (True, 0)]
+        assert User.query.filter_by(email='tomb@test.com').count() == 1
+
+
+def test_duplicate_live_row_is_rejected(app):
+    assert _add(app, Tag(name='dup_tag'))[0]
+    assert _add(app, Tag(name='dup_tag')) == (False, [('error', '标签已存在')])
+    assert _register(app, 'dup_user', 'dup@test.com', '13800000002') == [('message', '添加成功')]
+    assert _register(app, 'dup_user2', 'dup@test.com', '13800000003') == [('error', '邮箱已被注册')]
+    with app.app_context():
+        assert Tag.query.filter_by(name='dup_tag').count() == 1
@@ -0,0 +1,41 @@
+import io
+import os
+import stat
+
+from werkzeug.datastructures import FileStorage
+
+from app.libs.upload import StagedFile, ChunkedUpload, save_media
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_streamed_upload_is_readable_after_save(tmp_path):
+    # 暂存文件由mkstemp创建(0600)，保存后应与FileStorage.save的权限一致
+    staged = StagedFile(str(tmp_path / 'staging'))
+    staged.write(b'data')
+    assert _mode(staged.path) == 0o600
+    dst = str(tmp_path / 'movie.mp4')
+    save_media(FileStorage(staged, filename='movie.mp4'), dst)
+
+    expected = str(tmp_path / 'expected.mp4')
+    FileStorage(io.BytesIO(b'data'), filename='expected.mp4').save(expected)
+    assert _mode(dst) == _mode(expected) == 0o666 & ~_umask()
+
+
+def test_chunked_upload_is_readable_after_save(tmp_path):
+    upload = ChunkedUpload.create(str(tmp_path / 'staging'), 'movie.mp4', 4)
+    os.chmod(upload.part_path, 0o600)
+    upload.write(0, io.BytesIO(b'data'), 1024)
+    dst = str(tmp_path / 'movie.mp4')
+    save_media(upload, dst)
+    assert _mode(dst) == 0o666 & ~_umask()
+    with open(dst, 'rb') as f:
+        assert f.read() == b'data'